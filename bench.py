@@ -0,0 +1,393 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
+from psycopg2 import extensions as pg_extensions
+
+from fake_telegram import FakeBotAPI, make_callback_update, make_message_update, synthetic_updates
+
+# Нагрузочный тест обработчиков бота без Telegram: синтетические пользователи проходят сценарии
+# (/start, тренировка и ответы, добавление и удаление слов), ответы Bot API отдаёт локальная заглушка.
+# Пример: python bench.py --users 50 --steps 40
+#         BOT_MODE=async python bench.py --users 200 --concurrency 64 --embedded-db
+# Без --embedded-db используется БД из настроек DB_* (.env); недостающие миграции схемы применяются, как при запуске бота.
+# Пользователи бенчмарка получают telegram_id начиная с FIRST_USER_ID.
+# Заглушка Bot API по умолчанию работает в том же процессе и делит с ботом GIL; чтобы она не влияла
+# на задержки при высокой конкурентности, её можно запустить отдельно и передать адрес через --api-url:
+#         python fake_telegram.py --api-port 8081 & python bench.py --api-url http://127.0.0.1:8081
+# С --processes N обновления раздаёт супервизор main.Supervisor N процессам-воркерам; поток обновлений -
+# synthetic_updates из fake_telegram.py, измеряется пропускная способность до полной доработки очередей.
+
+FIRST_USER_ID = 9_000_000
+CORRECT_RATE = 0.8  # доля правильных ответов в тренировке
+
+# Сценарии и их веса: один шаг пользователя - одно действие из нескольких обновлений
+SCENARIOS = {
+    'start': 1,
+    'quiz': 12,
+    'typed': 3,
+    'add': 2,
+    'delete': 1,
+    'menu': 1,
+}
+
+
+# Курсор, считающий запросы к БД; на время служебных запросов бенчмарка счёт приостанавливается
+class CountingCursor(pg_extensions.cursor):
+    lock = threading.Lock()
+    queries = 0
+    paused = threading.local()
+
+    def _count(self):
+        if not getattr(CountingCursor.paused, 'value', False):
+            with CountingCursor.lock:
+                CountingCursor.queries += 1
+
+    def execute(self, query, vars=None):
+        self._count()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        self._count()
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        self._count()
+        return super().copy_expert(sql, file, size)
+
+
+class uncounted:
+    def __enter__(self):
+        CountingCursor.paused.value = True
+
+    def __exit__(self, *exc):
+        CountingCursor.paused.value = False
+
+
+# Встроенный PostgreSQL (пакет pgserver) во временном каталоге; схему создадут миграции бота
+def start_embedded_db():
+    try:
+        import pgserver
+    except ImportError:
+        sys.exit("Для --embedded-db нужен пакет pgserver: pip install pgserver")
+
+    server = pgserver.get_server(tempfile.mkdtemp(prefix="bench-pg-"), cleanup_mode='delete')
+    dsn = pg_extensions.parse_dsn(server.get_uri())
+    os.environ.update({
+        'DB_HOST': dsn.get('host', ''),
+        'DB_PORT': dsn.get('port', '5432'),
+        'DB_NAME': dsn.get('dbname', 'postgres'),
+        'DB_USER': dsn.get('user', 'postgres'),
+        'DB_PASSWORD': dsn.get('password', ''),
+    })
+    return server
+
+
+# Перцентиль по отсортированному списку
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+class Benchmark:
+    def __init__(self, main, args):
+        self.main = main
+        self.args = args
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors = Counter()
+        self._message_ids = itertools.count(1)
+        self._words = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def callback(self, chat_id: int, opcode: str, *args: int) -> Dict:
+        # Уникальный message_id, чтобы повторные нажатия не отсеивались как дубликаты
+        return make_callback_update(chat_id, self.main.encode_callback(opcode, *args), next(self._message_ids))
+
+    def session(self, chat_id: int):
+        with uncounted():
+            return self.main.sessions.get(chat_id)
+
+    def user_word_ids(self, chat_id: int) -> List[int]:
+        main = self.main
+        with uncounted():
+            user_id = main.get_or_create_user(main.types.User.de_json(make_message_update(chat_id, '')['message']['from']))
+            words, _, _ = main.get_user_words_page(user_id) if user_id else ([], False, False)
+        return [word_id for word_id, _, _ in words]
+
+    # Обновления одного действия; следующее обновление строится после обработки предыдущего
+    def scenario(self, chat_id: int, name: str) -> Iterator[Tuple[str, Dict]]:
+        main = self.main
+        if name == 'start':
+            yield 'start', make_message_update(chat_id, '/start')
+        elif name == 'quiz':
+            yield 'quiz', self.callback(chat_id, main.OP_START_QUIZ)
+            session = self.session(chat_id)
+            if session and session.card_token is not None:
+                option = session.correct_index
+                if random.random() >= CORRECT_RATE:
+                    option = (option + 1) % len(session.options)
+                yield 'answer', self.callback(chat_id, main.OP_ANSWER, session.card_token, option)
+        elif name == 'typed':
+            yield 'typed', self.callback(chat_id, main.OP_TYPED_QUIZ)
+            session = self.session(chat_id)
+            if session and session.correct_answer:
+                answer = main.answer_variants(session.correct_answer)[0]
+                if random.random() >= CORRECT_RATE:
+                    # Ошибка или опечатка: ответ без первой буквы
+                    answer = answer[1:] or 'x'
+                yield 'answer', make_message_update(chat_id, answer)
+        elif name == 'add':
+            number = next(self._words)
+            yield 'add', self.callback(chat_id, main.OP_ADD_WORD)
+            yield 'add', make_message_update(chat_id, f'слово{number}')
+            yield 'add', make_message_update(chat_id, f'word{number}')
+        elif name == 'delete':
+            yield 'delete', self.callback(chat_id, main.OP_DELETE_WORD)
+            word_ids = self.user_word_ids(chat_id)
+            if word_ids:
+                word_id = random.choice(word_ids)
+                yield 'delete', self.callback(chat_id, main.OP_ASK_DELETE, word_id)
+                yield 'delete', self.callback(chat_id, main.OP_CONFIRM_DELETE, word_id)
+        else:
+            yield 'menu', self.callback(chat_id, main.OP_MAIN_MENU)
+
+    # Все действия одного пользователя: сначала /start, затем случайные сценарии по весам
+    def user_updates(self, chat_id: int) -> Iterator[Tuple[str, Dict]]:
+        rng = random.Random(chat_id)
+        names, weights = zip(*SCENARIOS.items())
+        yield from self.scenario(chat_id, 'start')
+        for _ in range(self.args.steps):
+            yield from self.scenario(chat_id, rng.choices(names, weights)[0])
+
+    def record(self, kind: str, elapsed: float, error: Exception = None):
+        with self._lock:
+            self.latencies[kind].append(elapsed)
+            if error is not None:
+                self.errors[type(error).__name__] += 1
+
+    def run_sync(self, chat_ids: List[int]):
+        main = self.main
+        main.bot.threaded = False
+        types = main.types
+
+        def run_user(chat_id: int):
+            for kind, update in self.user_updates(chat_id):
+                started = time.perf_counter()
+                error = None
+                try:
+                    main.bot.process_new_updates([types.Update.de_json(update)])
+                except Exception as e:
+                    error = e
+                self.record(kind, time.perf_counter() - started, error)
+
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            list(executor.map(run_user, chat_ids))
+
+    async def run_async(self, chat_ids: List[int]):
+        main = self.main
+        types = main.types
+        limit = asyncio.Semaphore(self.args.concurrency)
+
+        async def run_user(chat_id: int):
+            async with limit:
+                for kind, update in self.user_updates(chat_id):
+                    started = time.perf_counter()
+                    error = None
+                    try:
+                        await main.api.process_new_updates([types.Update.de_json(update)])
+                    except Exception as e:
+                        error = e
+                    self.record(kind, time.perf_counter() - started, error)
+
+        try:
+            await asyncio.gather(*(run_user(chat_id) for chat_id in chat_ids))
+        finally:
+            await main.api.close_session()
+
+    def run(self) -> Dict:
+        main = self.main
+        chat_ids = [FIRST_USER_ID + i for i in range(self.args.users)]
+        with uncounted():
+            main.base_words_cache.refresh(force=True)
+        queries_before = CountingCursor.queries
+
+        started = time.perf_counter()
+        if main.BOT_MODE == 'async':
+            asyncio.run(self.run_async(chat_ids))
+        else:
+            self.run_sync(chat_ids)
+        elapsed = time.perf_counter() - started
+
+        # Дожидаемся фоновой записи ответов и исходящих сообщений, их запросы тоже относятся к нагрузке
+        main.card_queue.shutdown()
+        main.outbound.shutdown()
+        main.answer_log.shutdown()
+        queries = CountingCursor.queries - queries_before
+
+        updates = sum(len(values) for values in self.latencies.values())
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        calls = dict(self.args.api.calls) if self.args.api else {}
+        telegram_calls = sum(calls.values())
+        return {
+            'mode': main.BOT_MODE,
+            'users': self.args.users,
+            'updates': updates,
+            'errors': dict(self.errors),
+            'elapsed_s': round(elapsed, 3),
+            'updates_per_s': round(updates / elapsed, 1) if elapsed else 0.0,
+            'latency': latency_summary(all_latencies),
+            'latency_by_kind': {kind: latency_summary(values) for kind, values in sorted(self.latencies.items())},
+            'db_queries': queries,
+            'db_queries_per_update': round(queries / updates, 2) if updates else 0.0,
+            'telegram_calls': calls,
+            'telegram_calls_per_update': round(telegram_calls / updates, 2) if updates else 0.0,
+            'db_pool': main.db_pool_stats(),
+        }
+
+
+# Прогон через супервизор с несколькими процессами: задержки считают сами воркеры,
+# здесь - время от первого обновления до доработки всех очередей
+def run_processes(main, args) -> Dict:
+    updates = list(synthetic_updates(args.users, args.users * args.steps, FIRST_USER_ID))
+    supervisor = main.Supervisor(args.processes).start()
+    deadline = time.monotonic() + 60
+    while supervisor.snapshot()['started'] < args.processes and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+    started = time.perf_counter()
+    for update in updates:
+        supervisor.route(update)
+    supervisor.stop()
+    elapsed = time.perf_counter() - started
+
+    stats = supervisor.snapshot()
+    calls = dict(args.api.calls) if args.api else {}
+    return {
+        'mode': main.BOT_MODE,
+        'processes': args.processes,
+        'users': args.users,
+        'updates': len(updates),
+        'handled': stats['handled'],
+        'errors': stats['errors'],
+        'elapsed_s': round(elapsed, 3),
+        'updates_per_s': round(stats['handled'] / elapsed, 1) if elapsed else 0.0,
+        'telegram_calls': calls,
+    }
+
+
+def print_processes_report(report: Dict):
+    print(f"Режим: {report['mode']}, процессов: {report['processes']}, пользователей: {report['users']}")
+    print(f"Обработано обновлений: {report['handled']} из {report['updates']}, ошибок: {report['errors']}")
+    print(f"Время: {report['elapsed_s']} с, пропускная способность: {report['updates_per_s']} обновлений/с")
+    if report['telegram_calls']:
+        print(f"Вызовов Bot API: {sum(report['telegram_calls'].values())}: {report['telegram_calls']}")
+
+
+def print_report(report: Dict):
+    print(f"Режим: {report['mode']}, пользователей: {report['users']}, обновлений: {report['updates']}")
+    print(f"Время: {report['elapsed_s']} с, пропускная способность: {report['updates_per_s']} обновлений/с")
+    if report['errors']:
+        print(f"Ошибки: {report['errors']}")
+    print(f"{'':10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = [('all', report['latency'])] + list(report['latency_by_kind'].items())
+    for kind, stats in rows:
+        print(f"{kind:10}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+              f"{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    print(f"Запросов к БД: {report['db_queries']} ({report['db_queries_per_update']} на обновление)")
+    if report['telegram_calls']:
+        print(f"Вызовов Bot API: {sum(report['telegram_calls'].values())} "
+              f"({report['telegram_calls_per_update']} на обновление): {report['telegram_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест обработчиков бота с заглушкой Bot API')
+    parser.add_argument('--users', type=int, default=20, help='число синтетических пользователей')
+    parser.add_argument('--steps', type=int, default=20, help='действий на пользователя после /start')
+    parser.add_argument('--concurrency', type=int, default=16, help='одновременно активных пользователей')
+    parser.add_argument('--processes', type=int, default=0, help='число процессов-воркеров под супервизором')
+    parser.add_argument('--mode', choices=['sync', 'async'], default=None, help='режим бота (по умолчанию BOT_MODE)')
+    parser.add_argument('--api-url', default=None, help='адрес внешней заглушки Bot API (fake_telegram.py --api-port)')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа заглушки Bot API, сек')
+    parser.add_argument('--rate-limits', action='store_true', help='не отключать лимиты очереди исходящих сообщений')
+    parser.add_argument('--embedded-db', action='store_true', help='поднять временный PostgreSQL через pgserver')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', action='store_true', help='вывести отчёт в JSON')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    # Настройки читаются при импорте main, поэтому окружение готовим заранее
+    api = None if args.api_url else FakeBotAPI(latency=args.api_latency).start()
+    args.api = api
+    os.environ['TELEGRAM_API_URL'] = args.api_url or api.url
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:BENCHMARK')
+    if args.mode:
+        os.environ['BOT_MODE'] = args.mode
+    if not args.rate_limits:
+        # Лимиты Telegram измеряли бы ожидание в очереди, а не работу обработчиков
+        os.environ.setdefault('SEND_GLOBAL_RATE', '100000')
+        os.environ.setdefault('SEND_CHAT_RATE', '100000')
+        os.environ.setdefault('SEND_CHAT_BURST', '100000')
+    db_server = start_embedded_db() if args.embedded_db else None
+
+    try:
+        import main as bot_main
+        bot_main._db_pool = bot_main.DBPool(
+            bot_main.DB_POOL_MIN,
+            bot_main.DB_POOL_MAX,
+            dbname=os.getenv("DB_NAME"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            host=os.getenv("DB_HOST"),
+            port=os.getenv("DB_PORT"),
+            options=f"-c statement_timeout={bot_main.DB_STATEMENT_TIMEOUT_MS}",
+            cursor_factory=CountingCursor
+        )
+        with uncounted():
+            bot_main.migrate_schema()
+        if args.processes:
+            # Родительскому процессу соединения больше не нужны, запросы выполняют воркеры
+            bot_main.close_db_pool()
+            report = run_processes(bot_main, args)
+        else:
+            report = Benchmark(bot_main, args).run()
+            bot_main.close_db_pool()
+    finally:
+        if api is not None:
+            api.stop()
+        if db_server is not None:
+            db_server.cleanup()
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    elif args.processes:
+        print_processes_report(report)
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
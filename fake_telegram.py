@@ -0,0 +1,217 @@
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional
+
+# Локальный "Telegram": генерирует обновления и отправляет их боту, запущенному в режиме webhook.
+# Пример: BOT_UPDATES=webhook python main.py
+#         python fake_telegram.py --url http://127.0.0.1:8443/webhook --users 50 --count 1000
+# Заглушка Bot API, чтобы бот не обращался к настоящему Telegram:
+#         python fake_telegram.py --api-port 8081
+#         TELEGRAM_API_URL=http://127.0.0.1:8081 python main.py
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+# Пользователь Telegram
+def make_user(chat_id: int) -> Dict:
+    return {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}', 'username': f'user{chat_id}'}
+
+
+# Обновление с текстовым сообщением (команды размечаются как bot_command)
+def make_message_update(chat_id: int, text: str) -> Dict:
+    message = {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': make_user(chat_id),
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': next(_update_ids), 'message': message}
+
+
+# Обновление с нажатием inline-кнопки
+def make_callback_update(chat_id: int, data: str, message_id: int = 1) -> Dict:
+    return {
+        'update_id': next(_update_ids),
+        'callback_query': {
+            'id': str(next(_update_ids)),
+            'chat_instance': str(chat_id),
+            'from': make_user(chat_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': '',
+            },
+        },
+    }
+
+
+# Поток синтетических обновлений от нескольких пользователей (callback_data в формате main.encode_callback).
+# У каждого нажатия свой message_id, чтобы бот не отсеивал повторные нажатия как дубликаты
+def synthetic_updates(users: int, count: int, first_chat_id: int = 1000) -> Iterator[Dict]:
+    for _ in range(count):
+        chat_id = first_chat_id + random.randrange(users)
+        kind = random.random()
+        if kind < 0.1:
+            yield make_message_update(chat_id, '/start')
+        elif kind < 0.8:
+            yield make_callback_update(chat_id, '1q', next(_message_ids))
+        elif kind < 0.9:
+            yield make_callback_update(chat_id, '1w', next(_message_ids))
+        else:
+            yield make_callback_update(chat_id, '1m', next(_message_ids))
+
+
+# Отправка одного обновления на webhook, возвращает HTTP-статус
+def send_update(url: str, update: Dict, secret: Optional[str] = None, timeout: float = 10) -> int:
+    request = urllib.request.Request(url, data=json.dumps(update).encode('utf-8'), method='POST')
+    request.add_header('Content-Type', 'application/json')
+    if secret:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError):
+        # Сервер недоступен или оборвал соединение
+        return 0
+
+
+# Заглушка Bot API: отвечает на методы, которые вызывает бот, и считает вызовы
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    server: "FakeBotAPI"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, body: bytes, content_type: str = 'application/json'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _params(self) -> Dict:
+        url = urllib.parse.urlparse(self.path)
+        params = {key: values[0] for key, values in urllib.parse.parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        content_type = self.headers.get('Content-Type', '')
+        if 'json' in content_type:
+            params.update(json.loads(body or b'{}'))
+        elif 'urlencoded' in content_type:
+            params.update({key: values[0] for key, values in urllib.parse.parse_qs(body.decode()).items()})
+        return params
+
+    def do_POST(self):
+        if self.path.startswith('/file/'):
+            self._reply(self.server.file_content, 'application/octet-stream')
+            return
+        method = urllib.parse.urlparse(self.path).path.rsplit('/', 1)[-1]
+        params = self._params()
+        self.server.count(method)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self._reply(json.dumps({'ok': True, 'result': self.server.result(method, params)}).encode())
+
+    do_GET = do_POST
+
+
+class FakeBotAPI(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # при очереди 5 по умолчанию соединения под нагрузкой ждут повтора SYN
+
+    def __init__(self, address=('127.0.0.1', 0), latency: float = 0.0, file_content: bytes = b''):
+        super().__init__(address, FakeBotAPIHandler)
+        self.latency = latency  # искусственная задержка ответа, сек
+        self.file_content = file_content  # содержимое любого скачиваемого файла
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, method: str):
+        with self._lock:
+            self.calls[method] += 1
+
+    def result(self, method: str, params: Dict):
+        if method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            chat_id = int(params.get('chat_id', 0))
+            return {
+                'message_id': int(params.get('message_id') or next(self._message_ids)),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        if method == 'getFile':
+            return {'file_id': params.get('file_id', ''), 'file_unique_id': 'file', 'file_path': 'documents/file'}
+        if method == 'getUpdates':
+            # Обновлений нет; как long polling, не отвечаем сразу
+            time.sleep(min(float(params.get('timeout', 0)), 1.0))
+            return []
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        return True
+
+    def start(self) -> "FakeBotAPI":
+        threading.Thread(target=self.serve_forever, name="fake-bot-api", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Отправка синтетических обновлений на webhook бота')
+    parser.add_argument('--url', default='http://127.0.0.1:8443/webhook')
+    parser.add_argument('--secret', default=None)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--api-port', type=int, default=None, help='запустить только заглушку Bot API на этом порту')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа заглушки Bot API, сек')
+    args = parser.parse_args()
+
+    if args.api_port is not None:
+        api = FakeBotAPI(('127.0.0.1', args.api_port), latency=args.api_latency)
+        print(f"Заглушка Bot API: {api.url}")
+        try:
+            api.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        statuses = Counter(executor.map(
+            lambda update: send_update(args.url, update, args.secret),
+            synthetic_updates(args.users, args.count)
+        ))
+    elapsed = time.perf_counter() - started
+
+    print(f"Отправлено обновлений: {args.count} за {elapsed:.2f} с ({args.count / elapsed:.0f}/с)")
+    for status, count in sorted(statuses.items()):
+        print(f"  HTTP {status}: {count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,48 +1,804 @@
+import asyncio
+import bisect
+import csv
+import functools
+import heapq
+import io
+import json
+import multiprocessing
 import os
+import queue
 import random
+import re
+import signal
+import sqlite3
 import sys
+import tempfile
+import threading
+import time
 import traceback
-from contextlib import contextmanager
-from typing import Optional, Dict, List, Tuple
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json.encoder import encode_basestring
+from typing import Awaitable, Callable, Optional, Dict, List, Tuple
 
 from dotenv import load_dotenv
 import telebot
 from telebot import types
 import psycopg2
+from psycopg2 import extensions as pg_extensions
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import execute_values
 
 # Загрузка переменных окружения
 load_dotenv()
 
+# Режим работы: sync - TeleBot с пулом потоков, async - AsyncTeleBot на asyncio
+BOT_MODE = os.getenv("BOT_MODE", "sync")
+
+# Адрес Bot API можно переопределить (локальный Bot API сервер или заглушка для тестов)
+if os.getenv("TELEGRAM_API_URL"):
+    telebot.apihelper.API_URL = os.getenv("TELEGRAM_API_URL") + "/bot{0}/{1}"
+    telebot.apihelper.FILE_URL = os.getenv("TELEGRAM_API_URL") + "/file/bot{0}/{1}"
+
+# TeleBot, который выполняет задачи обработчиков одного чата в своём пуле потоков строго по очереди:
+# очередь чата ведётся в потоке polling, где обновления ещё идут по порядку
+class ChatOrderedTeleBot(telebot.TeleBot):
+    def _exec_task(self, task, *args, **kwargs):
+        update_object = args[0] if args else None
+        if not self.threaded or not isinstance(update_object, (types.Message, types.CallbackQuery)):
+            return super()._exec_task(task, *args, **kwargs)
+        chat_serializer.dispatch(update_chat_id(update_object), self.worker_pool.put,
+                                 functools.partial(task, *args, **kwargs))
+
+
 # Создание бота
-bot = telebot.TeleBot(os.getenv("TELEGRAM_BOT_TOKEN"))
+bot = ChatOrderedTeleBot(os.getenv("TELEGRAM_BOT_TOKEN"))
+
+# Метрики и журнал: без METRICS_PORT и LOG_FORMAT=json замеры не подключаются вовсе
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # порт эндпоинта /metrics в формате Prometheus
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+LOG_JSON = os.getenv("LOG_FORMAT", "text") == "json"  # json - журнал построчно в JSON
+METRICS_ENABLED = bool(METRICS_PORT) or LOG_JSON
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# Запись журнала в JSON одной строкой
+def log_event(level: str, event: str, **fields):
+    record = {'ts': round(time.time(), 3), 'level': level, 'event': event, **fields}
+    print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
+
+# Гистограммы длительности, счётчики ошибок и число выполняемых операций по видам:
+# handler - обработчики сообщений, callback - обработчики кнопок, db - запросы к БД, telegram - вызовы Bot API
+class Metrics:
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.buckets = buckets
+        self._histograms: Dict[Tuple[str, str], List[float]] = {}  # счётчики корзин, затем сумма и число
+        self._errors: Dict[Tuple[str, str, str], int] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def start(self, kind: str) -> float:
+        with self._lock:
+            self._in_flight[kind] = self._in_flight.get(kind, 0) + 1
+        return time.perf_counter()
+
+    def finish(self, kind: str, name: str, started: float, error: BaseException = None):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._in_flight[kind] -= 1
+        self.observe(kind, name, elapsed)
+        if error is not None:
+            self.count_error(kind, name, error)
+        if LOG_JSON:
+            log_event('info', kind, name=name, ms=round(elapsed * 1000, 3),
+                      error=type(error).__name__ if error is not None else None)
+
+    def observe(self, kind: str, name: str, seconds: float):
+        position = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get((kind, name))
+            if histogram is None:
+                histogram = self._histograms[(kind, name)] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            histogram[position] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def count_error(self, kind: str, name: str, error: BaseException):
+        key = (kind, name, type(error).__name__)
+        with self._lock:
+            self._errors[key] = self._errors.get(key, 0) + 1
+
+    # Текст в формате Prometheus; sources - {компонент: функция, возвращающая словарь счётчиков}
+    def render(self, sources: Dict[str, Callable[[], Dict]]) -> str:
+        with self._lock:
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+            errors = dict(self._errors)
+            in_flight = dict(self._in_flight)
+
+        lines = []
+        for kind in sorted({kind for kind, _ in histograms}):
+            metric = f"bot_{kind}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for (series_kind, name), values in sorted(histograms.items()):
+                if series_kind != kind:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{name="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{name="{name}"}} {values[-2]}')
+                lines.append(f'{metric}_count{{name="{name}"}} {values[-1]}')
+
+        lines.append("# TYPE bot_errors_total counter")
+        for (kind, name, error), count in sorted(errors.items()):
+            lines.append(f'bot_errors_total{{kind="{kind}",name="{name}",error="{error}"}} {count}')
+
+        lines.append("# TYPE bot_in_flight gauge")
+        for kind, count in sorted(in_flight.items()):
+            lines.append(f'bot_in_flight{{kind="{kind}"}} {count}')
+
+        lines.append("# TYPE bot_component gauge")
+        for component, snapshot in sources.items():
+            try:
+                stats = snapshot()
+            except Exception as e:
+                stats = {}
+                self.count_error('metrics', component, e)
+            for stat, value in sorted(stats.items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f'bot_component{{component="{component}",stat="{stat}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# Замер функции или корутины: длительность, ошибки и число выполняемых вызовов.
+# Если метрики выключены, функция возвращается как есть и ничего не стоит
+def timed(kind: str, name: str = None):
+    def decorate(func):
+        if not METRICS_ENABLED:
+            return func
+        label = name or func.__name__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = metrics.start(kind)
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException as e:
+                    metrics.finish(kind, label, started, e)
+                    raise
+                metrics.finish(kind, label, started)
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = metrics.start(kind)
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                metrics.finish(kind, label, started, e)
+                raise
+            metrics.finish(kind, label, started)
+            return result
+        return wrapper
+    return decorate
+
+
+# Перехваченная ошибка: сообщение в журнал (как раньше - print) и счётчик по типу исключения.
+# where - место ошибки для метрик, message - текст для журнала
+def log_error(where: str, e: BaseException, message: str = None, trace: bool = False):
+    message = message or f"Ошибка в {where}"
+    if METRICS_ENABLED:
+        metrics.count_error('caught', where, e)
+    if LOG_JSON:
+        log_event('error', 'error', where=where, message=message, error=type(e).__name__, detail=str(e),
+                  trace=traceback.format_exc() if trace else None)
+    elif trace:
+        print(f"{message}: {e}\nТрассировка: {traceback.format_exc()}")
+    else:
+        print(f"{message}: {e}")
+
+# Параметры пула соединений с БД
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # ожидание свободного соединения, сек
+DB_HEALTHCHECK_INTERVAL = float(os.getenv("DB_HEALTHCHECK_INTERVAL", "30"))  # простой до проверки, сек
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+
+# Пул долгоживущих соединений с PostgreSQL
+class DBPool:
+    def __init__(self, minconn: int, maxconn: int, **connect_kwargs):
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        # При запуске открывается minconn соединений, остальные - по мере надобности. Возвращённые соединения
+        # сверх minconn ThreadedConnectionPool закрывает, а нам нужно держать открытыми все до maxconn
+        self._pool.minconn = maxconn
+        # ThreadedConnectionPool не ждёт освобождения соединений, а сразу падает с PoolError
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self.maxconn = maxconn
+        self.stats = {
+            'checkouts': 0,
+            'in_use': 0,
+            'peak_in_use': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'reconnects': 0,
+            'healthchecks': 0,
+        }
+
+    def getconn(self, timeout: float = DB_POOL_TIMEOUT):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats['waits'] += 1
+            if not self._slots.acquire(timeout=timeout):
+                with self._lock:
+                    self.stats['timeouts'] += 1
+                raise pg_pool.PoolError("Нет свободных соединений в пуле")
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.stats['checkouts'] += 1
+            self.stats['in_use'] += 1
+            self.stats['peak_in_use'] = max(self.stats['peak_in_use'], self.stats['in_use'])
+        return conn
+
+    def putconn(self, conn, broken: bool = False):
+        with self._lock:
+            self.stats['in_use'] -= 1
+            if broken or conn.closed:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+        try:
+            # Незавершённую транзакцию пул откатит сам, разорванное соединение закрываем
+            self._pool.putconn(conn, close=broken or bool(conn.closed))
+        finally:
+            if conn.closed:
+                # Соединение закрыл пул (потеряна связь с сервером) - id может достаться новому
+                with self._lock:
+                    self._last_used.pop(id(conn), None)
+            self._slots.release()
+
+    def _checkout(self):
+        # Разорванное соединение (рестарт БД, сетевой сбой) заменяем следующим; после рестарта
+        # разорваны все простаивающие, поэтому проверяем каждое - самое большее по числу соединений пула,
+        # дальше свободных не остаётся и пул открывает новое
+        for _ in range(self.maxconn):
+            conn = self._pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            with self._lock:
+                self.stats['reconnects'] += 1
+                self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+        return self._pool.getconn()
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if conn.info.transaction_status == pg_extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None or time.monotonic() - last_used < DB_HEALTHCHECK_INTERVAL:
+            return True
+        with self._lock:
+            self.stats['healthchecks'] += 1
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.stats)
+        # Списки соединений ThreadedConnectionPool меняются под его собственной блокировкой
+        with self._pool._lock:
+            idle = len(self._pool._pool)
+            used = len(self._pool._used)
+        stats['size'] = idle + used
+        stats['idle'] = idle
+        stats['max'] = self.maxconn
+        return stats
+
+    def close(self):
+        self._pool.closeall()
+
+
+_db_pool: Optional[DBPool] = None
+_db_pool_lock = threading.Lock()
+
+
+# Ленивое создание пула при первом обращении к БД
+def get_db_pool() -> DBPool:
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = DBPool(
+                    DB_POOL_MIN,
+                    DB_POOL_MAX,
+                    dbname=os.getenv("DB_NAME"),
+                    user=os.getenv("DB_USER"),
+                    password=os.getenv("DB_PASSWORD"),
+                    host=os.getenv("DB_HOST"),
+                    port=os.getenv("DB_PORT"),
+                    options=f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+                )
+    return _db_pool
+
+
+# Закрытие всех соединений пула (при остановке бота)
+def close_db_pool():
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None:
+            _db_pool.close()
+            _db_pool = None
 
-# Глобальное хранилище данных пользователей
-user_data = {}
+
+# Счётчики использования пула соединений
+def db_pool_stats() -> Dict[str, int]:
+    if _db_pool is None:
+        return {}
+    return _db_pool.snapshot()
 
 
 # Контекстный менеджер для работы с БД
 @contextmanager
 def db_connection():
     conn = None
+    db_pool = get_db_pool()
     try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT")
-        )
+        conn = db_pool.getconn()
         yield conn
     except psycopg2.Error as e:
-        print(f"Ошибка подключения к БД: {e}")
+        log_error('db_connection', e, "Ошибка подключения к БД")
         raise
     finally:
         if conn:
-            conn.close()
+            db_pool.putconn(conn)
+
+
+# Миграции схемы: файлы migrations/NNN_описание.sql применяются по возрастанию номера,
+# номер применённой миграции записывается в schema_migrations в той же транзакции
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE_RE = re.compile(r"^(\d+)_\w+\.sql$")
+DB_MIGRATE = os.getenv("DB_MIGRATE", "1") != "0"  # 0 - только проверять версию схемы, не меняя её
+MIGRATIONS_LOCK_ID = 0x45434200  # ключ advisory-блокировки: миграции применяет один процесс
+
+
+# Список миграций (номер, имя файла) по возрастанию номера
+def list_migrations() -> List[Tuple[int, str]]:
+    migrations = []
+    for name in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE_RE.match(name)
+        if match:
+            migrations.append((int(match.group(1)), name))
+    migrations.sort()
+    numbers = [number for number, _ in migrations]
+    if len(set(numbers)) != len(numbers):
+        raise RuntimeError(f"Повторяющиеся номера миграций в {MIGRATIONS_DIR}")
+    return migrations
+
+
+# Версия схемы одним запросом; 0 - база ещё без таблицы schema_migrations
+def get_schema_version(conn) -> int:
+    with conn.cursor() as cur:
+        try:
+            cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            version = cur.fetchone()[0]
+        except psycopg2.errors.UndefinedTable:
+            version = 0
+    conn.rollback()
+    return version
+
+
+# Применение недостающих миграций; возвращает имена применённых файлов.
+# Если схема актуальна, это один запрос к БД
+def migrate_schema(apply: bool = DB_MIGRATE) -> List[str]:
+    migrations = list_migrations()
+    latest = migrations[-1][0] if migrations else 0
+    with db_connection() as conn:
+        version = get_schema_version(conn)
+        if version >= latest:
+            return []
+        if not apply:
+            raise RuntimeError(f"Схема БД версии {version}, а нужна {latest}: примените миграции из {MIGRATIONS_DIR}")
+
+        applied = []
+        with conn.cursor() as cur:
+            # Бот может запускаться несколькими процессами сразу - остальные ждут, пока первый закончит
+            cur.execute("SET LOCAL statement_timeout = 0")
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+            conn.commit()
+            try:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name VARCHAR(200) NOT NULL,
+                        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cur.execute("SELECT version FROM schema_migrations")
+                done = {row[0] for row in cur.fetchall()}
+                conn.commit()
+
+                for number, name in migrations:
+                    if number in done:
+                        continue
+                    with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+                        sql = f.read()
+                    # Построение индексов на большой таблице не укладывается в обычный statement_timeout
+                    cur.execute("SET LOCAL statement_timeout = 0")
+                    cur.execute(sql)
+                    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (number, name))
+                    conn.commit()
+                    applied.append(name)
+            finally:
+                conn.rollback()
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+                conn.commit()
+        return applied
+
+
+# Пул потоков для запросов к БД в режиме async: не больше потоков, чем соединений в пуле
+_db_executor: Optional[ThreadPoolExecutor] = None
+
+
+# Вызов функции работы с БД из обработчика: в режиме async - без блокировки event loop
+async def run_db(func, *args):
+    global _db_executor
+    if BOT_MODE != 'async':
+        return func(*args)
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=DB_POOL_MAX, thread_name_prefix="db")
+    return await asyncio.get_running_loop().run_in_executor(_db_executor, functools.partial(func, *args))
+
+
+# Параметры хранилища сессий чатов
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # memory, sqlite или postgres
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))  # время жизни неактивной сессии, сек
+SESSION_MAX = int(os.getenv("SESSION_MAX", "100000"))  # максимальное число сессий
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.sqlite3")
+SESSION_PURGE_EVERY = 1000  # как часто (в сохранениях) чистить устаревшие сессии во внешнем хранилище
+
+
+# Состояние чата: текущая карточка, ожидаемый ввод (слово, перевод, поиск) и фильтр списка слов
+class Session:
+    __slots__ = ('chat_id', 'correct_answer', 'question', 'other_words', 'message_id',
+                 'card_token', 'options', 'correct_index', 'word_id', 'failed', 'sent_at',
+                 'previous_word', 'adding_word', 'input_step', 'words_prefix', 'touched_at')
+    FIELDS = __slots__[1:-1]
+
+    def __init__(self, chat_id: int, **fields):
+        self.chat_id = chat_id
+        for name in self.FIELDS:
+            setattr(self, name, fields.get(name))
+        self.touched_at = time.time()
+
+    # Сброс карточки после правильного ответа (previous_word нужен для проверки на повторение)
+    def clear_quiz(self):
+        self.correct_answer = None
+        self.question = None
+        self.other_words = None
+        self.message_id = None
+        self.card_token = None
+        self.options = None
+        self.correct_index = None
+        self.word_id = None
+        self.failed = None
+        self.sent_at = None
+
+    def to_json(self) -> str:
+        return json.dumps({name: getattr(self, name) for name in self.FIELDS
+                           if getattr(self, name) is not None}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, chat_id: int, data: str) -> "Session":
+        return cls(chat_id, **json.loads(data))
+
+
+# Интерфейс хранилища сессий: бэкенд без get/save/delete/size не создастся
+class SessionStore(ABC):
+    # Требует ли хранилище ввода-вывода (тогда в режиме async оно вызывается через run_db)
+    blocking = True
+
+    def __init__(self, ttl: float = SESSION_TTL, max_size: int = SESSION_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'saves': 0}
+
+    @abstractmethod
+    def get(self, chat_id: int) -> Optional[Session]:
+        ...
+
+    @abstractmethod
+    def save(self, session: Session):
+        ...
+
+    @abstractmethod
+    def delete(self, chat_id: int):
+        ...
+
+    @abstractmethod
+    def size(self) -> int:
+        ...
+
+    def get_or_create(self, chat_id: int) -> Session:
+        return self.get(chat_id) or Session(chat_id)
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self.stats[name] += value
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['size'] = self.size()
+        return stats
+
+
+# Сессии в памяти процесса: LRU с ограничением по размеру и времени жизни
+class MemorySessionStore(SessionStore):
+    blocking = False
+
+    def __init__(self, ttl: float = SESSION_TTL, max_size: int = SESSION_MAX):
+        super().__init__(ttl, max_size)
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+
+    def get(self, chat_id: int) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is None:
+                self.stats['misses'] += 1
+                return None
+            if time.time() - session.touched_at > self.ttl:
+                del self._sessions[chat_id]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            return session
+
+    def save(self, session: Session):
+        session.touched_at = time.time()
+        with self._lock:
+            self.stats['saves'] += 1
+            self._sessions[session.chat_id] = session
+            self._sessions.move_to_end(session.chat_id)
+            # Самые давно использованные сессии - в начале словаря
+            while self._sessions:
+                oldest = next(iter(self._sessions.values()))
+                if len(self._sessions) > self.max_size:
+                    self.stats['evicted'] += 1
+                elif session.touched_at - oldest.touched_at > self.ttl:
+                    self.stats['expired'] += 1
+                else:
+                    break
+                self._sessions.popitem(last=False)
+
+    def delete(self, chat_id: int):
+        with self._lock:
+            self._sessions.pop(chat_id, None)
+
+    def size(self) -> int:
+        return len(self._sessions)
+
+
+# Сессии в файле SQLite: переживают перезапуск, доступны нескольким процессам на одной машине
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path: str = SESSION_SQLITE_PATH, ttl: float = SESSION_TTL, max_size: int = SESSION_MAX):
+        super().__init__(ttl, max_size)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                chat_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at_idx ON sessions (updated_at)")
+        self._db_lock = threading.Lock()
+
+    def get(self, chat_id: int) -> Optional[Session]:
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE chat_id = ? AND updated_at > ?",
+                (chat_id, time.time() - self.ttl)
+            ).fetchone()
+        self._count('hits' if row else 'misses')
+        return Session.from_json(chat_id, row[0]) if row else None
+
+    def save(self, session: Session):
+        session.touched_at = time.time()
+        with self._db_lock:
+            self._conn.execute("""
+                INSERT INTO sessions (chat_id, data, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (chat_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            """, (session.chat_id, session.to_json(), session.touched_at))
+        self._count('saves')
+        if self.stats['saves'] % SESSION_PURGE_EVERY == 0:
+            self.purge()
+
+    def delete(self, chat_id: int):
+        with self._db_lock:
+            self._conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+
+    def purge(self):
+        with self._db_lock:
+            expired = self._conn.execute(
+                "DELETE FROM sessions WHERE updated_at <= ?", (time.time() - self.ttl,)).rowcount
+            evicted = self._conn.execute("""
+                DELETE FROM sessions WHERE chat_id IN (
+                    SELECT chat_id FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_size,)).rowcount
+        self._count('expired', expired)
+        self._count('evicted', evicted)
+
+    def size(self) -> int:
+        with self._db_lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+# Сессии в PostgreSQL: общие для всех процессов и серверов бота
+class PostgresSessionStore(SessionStore):
+    @timed('db', 'session_get')
+    def get(self, chat_id: int) -> Optional[Session]:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT data::text FROM bot_sessions
+                    WHERE chat_id = %s AND updated_at > NOW() - %s * INTERVAL '1 second'
+                """, (chat_id, self.ttl))
+                row = cur.fetchone()
+        self._count('hits' if row else 'misses')
+        return Session.from_json(chat_id, row[0]) if row else None
+
+    @timed('db', 'session_save')
+    def save(self, session: Session):
+        session.touched_at = time.time()
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO bot_sessions (chat_id, data, updated_at) VALUES (%s, %s, NOW())
+                    ON CONFLICT (chat_id) DO UPDATE SET data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+                """, (session.chat_id, session.to_json()))
+            conn.commit()
+        self._count('saves')
+        if self.stats['saves'] % SESSION_PURGE_EVERY == 0:
+            self.purge()
+
+    @timed('db', 'session_delete')
+    def delete(self, chat_id: int):
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM bot_sessions WHERE chat_id = %s", (chat_id,))
+            conn.commit()
+
+    def purge(self):
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM bot_sessions WHERE updated_at <= NOW() - %s * INTERVAL '1 second'",
+                            (self.ttl,))
+                expired = cur.rowcount
+                cur.execute("""
+                    DELETE FROM bot_sessions WHERE chat_id IN (
+                        SELECT chat_id FROM bot_sessions ORDER BY updated_at DESC OFFSET %s
+                    )
+                """, (self.max_size,))
+                evicted = cur.rowcount
+            conn.commit()
+        self._count('expired', expired)
+        self._count('evicted', evicted)
+
+    def size(self) -> int:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM bot_sessions")
+                return cur.fetchone()[0]
+
+
+# Создание хранилища сессий по настройке SESSION_BACKEND
+def create_session_store() -> SessionStore:
+    if SESSION_BACKEND == 'sqlite':
+        return SQLiteSessionStore()
+    if SESSION_BACKEND == 'postgres':
+        return PostgresSessionStore()
+    return MemorySessionStore()
+
+
+sessions = create_session_store()
+
+
+# Загрузка сессии чата из обработчика
+async def load_session(chat_id: int, create: bool = False) -> Optional[Session]:
+    getter = sessions.get_or_create if create else sessions.get
+    return await run_db(getter, chat_id) if sessions.blocking else getter(chat_id)
+
+
+# Сохранение сессии чата из обработчика
+async def save_session(session: Session):
+    if sessions.blocking:
+        await run_db(sessions.save, session)
+    else:
+        sessions.save(session)
+
+
+# Размер кэша пользователей (telegram_id -> id в БД)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+
+# LRU-кэш пользователей: id в БД и последний известный профиль
+class UserCache:
+    def __init__(self, max_size: int = USER_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: "OrderedDict[int, Tuple[int, Optional[str], Optional[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'profile_changes': 0, 'evictions': 0}
+
+    def get(self, user: types.User) -> Optional[int]:
+        with self._lock:
+            cached = self._items.get(user.id)
+            if cached is None:
+                self.stats['misses'] += 1
+                return None
+            if cached[1:] != (user.username, user.first_name):
+                self.stats['profile_changes'] += 1
+                return None
+            self._items.move_to_end(user.id)
+            self.stats['hits'] += 1
+            return cached[0]
+
+    def put(self, user: types.User, user_id: int):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[user.id] = (user_id, user.username, user.first_name)
+            self._items.move_to_end(user.id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self._items)
+        stats['max_size'] = self.max_size
+        return stats
+
+
+user_cache = UserCache()
 
 
 # Добавление пользователя или получение его ID
+@timed('db')
 def get_or_create_user(user: types.User) -> Optional[int]:
+    # Запись в БД нужна только для нового пользователя или при смене профиля
+    user_id = user_cache.get(user)
+    if user_id is not None:
+        return user_id
     try:
         with db_connection() as conn:
             with conn.cursor() as cur:
@@ -55,156 +811,1255 @@ def get_or_create_user(user: types.User) -> Optional[int]:
                 """, (user.id, user.username, user.first_name))
                 user_id = cur.fetchone()[0]
                 conn.commit()
+                user_cache.put(user, user_id)
                 return user_id
     except Exception as e:
-        print(f"Ошибка в get_or_create_user: {e}")
+        log_error('get_or_create_user', e)
         return None
 
 
-# Получение количества слов пользователя
-def get_user_words_count(user_id: int) -> int:
+# Счётчики пользователя в user_stats (порядок столбцов в запросах RETURNING)
+USER_STATS_COLUMNS = ('words_count', 'answers', 'correct_answers', 'streak', 'best_streak')
+USER_STATS_RETURNING = "RETURNING " + ", ".join("user_stats." + column for column in ('user_id',) + USER_STATS_COLUMNS)
+
+
+# LRU-кэш счётчиков: заполняется значениями, возвращёнными из БД после каждого изменения
+class UserStatsCache:
+    def __init__(self, max_size: int = USER_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: "OrderedDict[int, Dict[str, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'updates': 0}
+
+    def get(self, user_id: int) -> Optional[Dict[str, int]]:
+        with self._lock:
+            counters = self._items.get(user_id)
+            self.stats['hits' if counters else 'misses'] += 1
+            if counters:
+                self._items.move_to_end(user_id)
+            return counters
+
+    # row - строка (user_id, words_count, answers, ...), как её возвращает USER_STATS_RETURNING
+    def put(self, row: Tuple):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[row[0]] = dict(zip(USER_STATS_COLUMNS, row[1:]))
+            self._items.move_to_end(row[0])
+            self.stats['updates'] += 1
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self._items)
+        return stats
+
+
+user_stats_cache = UserStatsCache()
+
+
+# Строки user_stats для пользователей, у которых их ещё нет (созданы до появления счётчиков):
+# число слов считается один раз. Вызывать до изменения user_words в той же транзакции
+def ensure_user_stats(cur, user_ids: List[int]):
+    cur.execute("""
+        INSERT INTO user_stats (user_id, words_count)
+        SELECT ids.user_id, (SELECT COUNT(*) FROM user_words WHERE user_words.user_id = ids.user_id)
+        FROM unnest(%s::integer[]) AS ids(user_id)
+        WHERE NOT EXISTS (SELECT 1 FROM user_stats WHERE user_stats.user_id = ids.user_id)
+        ON CONFLICT (user_id) DO NOTHING
+    """, (list(user_ids),))
+
+
+# Изменение числа слов пользователя в той же транзакции, что и изменение user_words
+def change_words_count(cur, user_id: int, delta: int) -> Tuple:
+    cur.execute(f"""
+        UPDATE user_stats SET words_count = words_count + %s
+        WHERE user_id = %s
+        {USER_STATS_RETURNING}
+    """, (delta, user_id))
+    return cur.fetchone()
+
+
+# Счётчики пользователя: из кэша, при промахе - одна строка user_stats по первичному ключу
+@timed('db')
+def get_user_stats(user_id: int) -> Optional[Dict[str, int]]:
+    counters = user_stats_cache.get(user_id)
+    if counters:
+        return counters
     try:
         with db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT COUNT(*) FROM user_words 
+                ensure_user_stats(cur, [user_id])
+                cur.execute(f"""
+                    SELECT user_id, {", ".join(USER_STATS_COLUMNS)} FROM user_stats
                     WHERE user_id = %s
                 """, (user_id,))
-                return cur.fetchone()[0]
+                row = cur.fetchone()
+                conn.commit()
+        user_stats_cache.put(row)
+        return dict(zip(USER_STATS_COLUMNS, row[1:]))
     except Exception as e:
-        print(f"Ошибка в get_user_words_count: {e}")
-        return 0
+        log_error('get_user_stats', e)
+        return None
+
 
+# Параметры выборки слов для карточек
+BASE_WORDS_TTL = float(os.getenv("BASE_WORDS_TTL", "60"))  # как часто проверять изменения base_words, сек
+# Строки, изменённые за столько секунд до последнего прочитанного изменения, перечитываются при каждой
+# проверке: транзакция, которая коммитится дольше, может появиться с updated_at раньше уже прочитанных
+BASE_WORDS_OVERLAP = float(os.getenv("BASE_WORDS_OVERLAP", "300"))
+SAMPLE_ATTEMPTS = 10  # Максимальное количество попыток найти подходящее слово
+DISTRACTORS_COUNT = 3
 
-# Получение случайного слова и вариантов (с проверкой на повторение)
+# Параметры интервального повторения (SM-2) для слов пользователя
+SRS_RELEARN_MINUTES = float(os.getenv("SRS_RELEARN_MINUTES", "10"))  # когда повторить слово после ошибки
+SRS_MIN_EASE = 1.3
+SRS_QUALITY_CORRECT = 4  # оценка SM-2 за верный ответ с первой попытки
+SRS_QUALITY_WRONG = 1  # оценка SM-2 за ошибку
+
+
+# Следующее состояние слова по SM-2: (лёгкость, интервал в днях, число успешных повторений подряд)
+def sm2_next(ease: float, interval_days: float, repetitions: int, quality: int) -> Tuple[float, float, int]:
+    if quality < 3:
+        repetitions = 0
+        interval_days = SRS_RELEARN_MINUTES / (24 * 60)
+    else:
+        if repetitions == 0:
+            interval_days = 1
+        elif repetitions == 1:
+            interval_days = 6
+        else:
+            interval_days = interval_days * ease
+        repetitions += 1
+    ease = max(SRS_MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return ease, interval_days, repetitions
+
+
+# Слова пользователя, которые пора повторить, начиная с самых просроченных (индекс user_id, due_at).
+# Новые слова получают due_at при добавлении и попадают сюда сразу
+def get_due_user_words(cur, user_id: int, limit: int, exclude_ids: List[int] = ()) -> List[Tuple[int, str, str]]:
+    cur.execute("""
+        SELECT id, word, translation FROM user_words
+        WHERE user_id = %s AND due_at <= CURRENT_TIMESTAMP AND id <> ALL(%s)
+        ORDER BY due_at
+        LIMIT %s
+    """, (user_id, list(exclude_ids), limit))
+    return cur.fetchall()
+
+
+# Снимок таблицы base_words: параллельные массивы вместо словарей на каждую строку
+class BaseWordsSnapshot:
+    __slots__ = ('ids', 'words', 'translations', 'distinct_translations', 'positions', 'version')
+
+    def __init__(self, rows: List[Tuple[int, str, str]], version=None):
+        self.ids = array('i', (row[0] for row in rows))
+        self.words = [sys.intern(row[1]) for row in rows]
+        self.translations = [sys.intern(row[2]) for row in rows]
+        self.distinct_translations = list(dict.fromkeys(self.translations))
+        self.positions = {word_id: i for i, word_id in enumerate(self.ids)}
+        self.version = version
+
+    def rows(self) -> List[Tuple[int, str, str]]:
+        return list(zip(self.ids, self.words, self.translations))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+# Общий для всех пользователей кэш base_words с обновлением по версии (COUNT, MAX(updated_at))
+class BaseWordsCache:
+    def __init__(self, ttl: float = BASE_WORDS_TTL, overlap: float = BASE_WORDS_OVERLAP):
+        self.ttl = ttl
+        self.overlap = overlap
+        self._snapshot: Optional[BaseWordsSnapshot] = None
+        self._checked_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'full_reloads': 0,
+            'incremental_reloads': 0,
+            'version_checks': 0,
+            'last_reload_ms': 0.0,
+            'total_reload_ms': 0.0,
+        }
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _version(self, cur):
+        self._count('version_checks')
+        cur.execute("SELECT COUNT(*), MAX(updated_at) FROM base_words")
+        return cur.fetchone()
+
+    def _full_reload(self, cur, version):
+        cur.execute("SELECT id, word, translation FROM base_words ORDER BY id")
+        self._snapshot = BaseWordsSnapshot(cur.fetchall(), version)
+        self._count('full_reloads')
+
+    # Догрузка строк, изменённых после прочитанного MAX(updated_at) с запасом overlap секунд.
+    # Запас перечитывается при каждой проверке, даже если версия не изменилась: поздно закоммиченное
+    # изменение не меняет ни COUNT, ни MAX. Новый снимок создаётся, только если строки действительно другие
+    def _incremental_reload(self, cur, version) -> bool:
+        old = self._snapshot
+        cur.execute("""
+            SELECT id, word, translation FROM base_words
+            WHERE updated_at >= %s - %s * INTERVAL '1 second'
+            ORDER BY id
+        """, (old.version[1], self.overlap))
+        rows = old.rows()
+        changed = False
+        for row in cur.fetchall():
+            position = old.positions.get(row[0])
+            if position is None:
+                rows.append(row)
+                changed = True
+            elif rows[position] != row:
+                rows[position] = row
+                changed = True
+        if len(rows) != version[0]:
+            # Строки удалялись - инкрементально это не восстановить
+            return False
+        if changed or version != old.version:
+            self._snapshot = BaseWordsSnapshot(rows, version)
+            self._count('incremental_reloads')
+        return True
+
+    @timed('db', 'base_words_refresh')
+    def refresh(self, force: bool = False):
+        # Обновляет только один поток, остальные продолжают читать старый снимок
+        if not self._refresh_lock.acquire(blocking=force or self._snapshot is None):
+            return
+        try:
+            if not force and self._snapshot is not None and time.monotonic() - self._checked_at < self.ttl:
+                return
+            started = time.perf_counter()
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    version = self._version(cur)
+                    if force or self._snapshot is None or self._snapshot.version[1] is None:
+                        self._full_reload(cur, version)
+                    elif not self._incremental_reload(cur, version):
+                        self._full_reload(cur, version)
+            self._checked_at = time.monotonic()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._stats_lock:
+                self.stats['last_reload_ms'] = round(elapsed_ms, 3)
+                self.stats['total_reload_ms'] = round(self.stats['total_reload_ms'] + elapsed_ms, 3)
+        finally:
+            self._refresh_lock.release()
+
+    def snapshot(self) -> BaseWordsSnapshot:
+        self._count('misses' if self._snapshot is None else 'hits')
+        if self._snapshot is None or time.monotonic() - self._checked_at >= self.ttl:
+            try:
+                self.refresh()
+            except Exception as e:
+                if self._snapshot is None:
+                    raise
+                # БД недоступна - продолжаем работать со старым снимком
+                log_error('base_words_cache', e, "Ошибка обновления кэша base_words")
+                self._checked_at = time.monotonic()
+        return self._snapshot
+
+    # Случайное базовое слово, не совпадающее с предыдущим
+    def sample_word(self, previous_word: str = None) -> Optional[Tuple[str, str]]:
+        snapshot = self.snapshot()
+        if not snapshot:
+            return None
+        for _ in range(SAMPLE_ATTEMPTS):
+            i = random.randrange(len(snapshot))
+            if snapshot.words[i] != previous_word:
+                return snapshot.words[i], snapshot.translations[i]
+        return None
+
+    # Неправильные варианты перевода: уникальные и отличные от правильного
+    def sample_distractors(self, translation: str, count: int = DISTRACTORS_COUNT,
+                           exclude: List[str] = ()) -> List[str]:
+        pool = self.snapshot().distinct_translations
+        distractors = []
+        for _ in range(count * SAMPLE_ATTEMPTS):
+            if len(distractors) >= count or not pool:
+                break
+            candidate = random.choice(pool)
+            if candidate != translation and candidate not in distractors and candidate not in exclude:
+                distractors.append(candidate)
+        return distractors
+
+    def snapshot_stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['size'] = len(self._snapshot) if self._snapshot is not None else 0
+        return stats
+
+
+base_words_cache = BaseWordsCache()
+
+
+# Карточка для слова: варианты ответа и id слова пользователя (None для базовых слов)
+def make_card(word: str, translation: str, word_id: Optional[int] = None) -> Dict:
+    return {
+        'id': word_id,
+        'word': word,
+        'translation': translation,
+        'other_words': base_words_cache.sample_distractors(translation),
+        'type': 'user' if word_id else 'base'
+    }
+
+
+# Следующая карточка без очереди: самое просроченное слово пользователя (не совпадающее с предыдущим),
+# если повторять нечего - случайное базовое слово
+@timed('db')
 def get_random_word_with_options(user_id: int, previous_word: str = None) -> Optional[Dict]:
     try:
         with db_connection() as conn:
             with conn.cursor() as cur:
-                word_data = None
-                word_type = None
-                attempts = 0
-                max_attempts = 10  # Максимальное количество попыток найти уникальное слово
-
-                while attempts < max_attempts:
-                    attempts += 1
-
-                    # Сначала пробуем получить пользовательское слово (50% chance)
-                    if random.random() > 0.5:
-                        if previous_word:
-                            cur.execute("""
-                                SELECT word, translation FROM user_words 
-                                WHERE user_id = %s AND word != %s
-                                ORDER BY RANDOM() 
-                                LIMIT 1
-                            """, (user_id, previous_word))
-                        else:
-                            cur.execute("""
-                                SELECT word, translation FROM user_words 
-                                WHERE user_id = %s 
-                                ORDER BY RANDOM() 
-                                LIMIT 1
-                            """, (user_id,))
-                        word_data = cur.fetchone()
-                        word_type = 'user'
-
-                    # Если не нашли пользовательское слово, берем из базы
-                    if not word_data:
-                        if previous_word:
-                            cur.execute("""
-                                SELECT word, translation FROM base_words 
-                                WHERE word != %s
-                                ORDER BY RANDOM() 
-                                LIMIT 1
-                            """, (previous_word,))
-                        else:
-                            cur.execute("""
-                                SELECT word, translation FROM base_words 
-                                ORDER BY RANDOM() 
-                                LIMIT 1
-                            """)
-                        word_data = cur.fetchone()
-                        word_type = 'base'
-
-                    if not word_data:
-                        continue  # Если слова нет, пробуем еще раз
-
-                    word, translation = word_data
-
-                    # Получаем 3 случайных неправильных варианта перевода
-                    cur.execute("""
-                        SELECT translation FROM base_words 
-                        WHERE translation != %s 
-                        ORDER BY RANDOM() 
-                        LIMIT 3
-                    """, (translation,))
-                    other_words = [row[0] for row in cur.fetchall()]
-
-                    return {
-                        'word': word,
-                        'translation': translation,
-                        'other_words': other_words,
-                        'type': word_type
-                    }
-
-                # Если не нашли уникальное слово после всех попыток
-                return None
+                for word_id, word, translation in get_due_user_words(cur, user_id, 2):
+                    if word != previous_word:
+                        return make_card(word, translation, word_id)
+
+        # Повторять нечего - берем из базы (из кэша, без запроса к БД)
+        word_data = base_words_cache.sample_word(previous_word)
+        if not word_data:
+            return None
+        return make_card(*word_data)
 
     except Exception as e:
-        print(f"Ошибка в get_random_word_with_options: {e}")
+        log_error('get_random_word_with_options', e)
         return None
 
 
+# Пакетная генерация карточек: один запрос за пакетом слов к повторению, остаток - базовые слова.
+# exclude_ids - слова, уже стоящие в очереди
+@timed('db')
+def generate_cards(user_id: int, count: int, exclude_ids: List[int] = ()) -> List[Dict]:
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                due_rows = get_due_user_words(cur, user_id, count, exclude_ids)
+    except Exception as e:
+        log_error('generate_cards', e)
+        return []
+
+    cards = [make_card(word, translation, word_id) for word_id, word, translation in due_rows]
+    while len(cards) < count:
+        word_data = base_words_cache.sample_word()
+        if not word_data:
+            break
+        cards.append(make_card(*word_data))
+    return cards
+
+
+# Запись результата ответа на карточку со словом пользователя и перенос срока повторения
+@timed('db')
+def record_review(user_id: int, word_id: int, correct: bool) -> bool:
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT ease, interval_days, repetitions FROM user_words
+                    WHERE user_id = %s AND id = %s
+                    FOR UPDATE
+                """, (user_id, word_id))
+                row = cur.fetchone()
+                if not row:
+                    conn.rollback()
+                    return False
+                quality = SRS_QUALITY_CORRECT if correct else SRS_QUALITY_WRONG
+                ease, interval_days, repetitions = sm2_next(*row, quality)
+                cur.execute("""
+                    UPDATE user_words
+                    SET ease = %s, interval_days = %s, repetitions = %s,
+                        due_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 day',
+                        reviewed_at = CURRENT_TIMESTAMP
+                    WHERE user_id = %s AND id = %s
+                """, (ease, interval_days, repetitions, interval_days, user_id, word_id))
+                conn.commit()
+        card_queue.on_word_reviewed(user_id, word_id)
+        return True
+    except Exception as e:
+        log_error('record_review', e)
+        return False
+
+
+# Параметры очереди заранее подготовленных карточек
+CARD_QUEUE_SIZE = int(os.getenv("CARD_QUEUE_SIZE", "10"))  # сколько карточек готовить за раз
+CARD_QUEUE_LOW_WATER = int(os.getenv("CARD_QUEUE_LOW_WATER", "3"))  # порог фоновой дозагрузки
+CARD_QUEUE_MAX_USERS = int(os.getenv("CARD_QUEUE_MAX_USERS", "10000"))
+CARD_QUEUE_WORKERS = int(os.getenv("CARD_QUEUE_WORKERS", "2"))
+
+
+# Очередь карточек пользователя, подготовленных заранее
+class CardQueue:
+    def __init__(self, batch_size: int = CARD_QUEUE_SIZE, low_water: int = CARD_QUEUE_LOW_WATER,
+                 max_users: int = CARD_QUEUE_MAX_USERS):
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self.max_users = max_users
+        self._queues: "OrderedDict[int, deque]" = OrderedDict()
+        # Поколение очереди растёт при изменении слов: устаревшая дозагрузка отбрасывается
+        self._generations: Dict[int, int] = {}
+        self._refilling = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=CARD_QUEUE_WORKERS, thread_name_prefix="card-queue")
+        self.stats = {'hits': 0, 'misses': 0, 'refills': 0, 'skipped_repeats': 0, 'invalidated': 0}
+
+    def _fill(self, user_id: int, generation: int, cards: List[Dict]):
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return
+            queue = self._queues.get(user_id)
+            if queue is None:
+                queue = self._queues[user_id] = deque()
+                while len(self._queues) > self.max_users:
+                    evicted, _ = self._queues.popitem(last=False)
+                    self._generations.pop(evicted, None)
+            queue.extend(cards)
+            self._queues.move_to_end(user_id)
+
+    def _refill(self, user_id: int, generation: int, exclude_ids: List[int]):
+        try:
+            self._fill(user_id, generation, generate_cards(user_id, self.batch_size, exclude_ids))
+            with self._lock:
+                self.stats['refills'] += 1
+        finally:
+            with self._lock:
+                self._refilling.discard(user_id)
+
+    def _schedule_refill(self, user_id: int):
+        # Вызывается под self._lock
+        if user_id in self._refilling:
+            return
+        self._refilling.add(user_id)
+        queued_ids = [card['id'] for card in self._queues.get(user_id, ()) if card['id']]
+        self._executor.submit(self._refill, user_id, self._generations.get(user_id, 0), queued_ids)
+
+    def _pop(self, user_id: int, previous_word: str = None) -> Optional[Dict]:
+        with self._lock:
+            queue = self._queues.get(user_id)
+            card = None
+            while queue:
+                candidate = queue.popleft()
+                if candidate['word'] != previous_word:
+                    card = candidate
+                    break
+                self.stats['skipped_repeats'] += 1
+            if queue is None or len(queue) < self.low_water:
+                self._schedule_refill(user_id)
+            self.stats['hits' if card else 'misses'] += 1
+            return card
+
+    def next_card(self, user_id: int, previous_word: str = None) -> Optional[Dict]:
+        card = self._pop(user_id, previous_word)
+        if card:
+            return card
+        # Очередь пуста (первое обращение) - считаем карточку синхронно, пакет догрузится в фоне
+        return get_random_word_with_options(user_id, previous_word)
+
+    # Новое слово или новый перевод: подготовленные карточки больше не отражают словарь
+    def on_word_added(self, user_id: int):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            queue = self._queues.pop(user_id, None)
+            if queue:
+                self.stats['invalidated'] += len(queue)
+
+    def _drop(self, user_id: int, predicate: Callable[[Dict], bool]):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            queue = self._queues.get(user_id)
+            if queue:
+                kept = [card for card in queue if not predicate(card)]
+                self.stats['invalidated'] += len(queue) - len(kept)
+                self._queues[user_id] = deque(kept)
+
+    # Удалённое слово не должно попасться в уже подготовленных карточках
+    def on_word_deleted(self, user_id: int, word: str):
+        self._drop(user_id, lambda card: card['word'] == word)
+
+    # Повторённое слово получило новый срок: подготовленная раньше карточка с ним больше не нужна
+    def on_word_reviewed(self, user_id: int, word_id: int):
+        self._drop(user_id, lambda card: card['id'] == word_id)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['users'] = len(self._queues)
+            stats['cards'] = sum(len(queue) for queue in self._queues.values())
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+card_queue = CardQueue()
+
+
+# Тренировка с вводом перевода: допустимые опечатки и подсказки "возможно, вы имели в виду"
+TYPED_MAX_TYPOS = int(os.getenv("TYPED_MAX_TYPOS", "2"))  # больше этого число ошибок не прощается
+TYPED_SUGGESTIONS = 3  # сколько похожих слов подсказывать
+TYPED_INDEX_USERS = int(os.getenv("TYPED_INDEX_USERS", "10000"))  # пользователей, чьи слова держатся в индексе
+ANSWER_WORD_RE = re.compile(r"\w+(?:['’-]\w+)*")
+ANSWER_VARIANTS_RE = re.compile(r"[,;/]")
+
+
+# Ответ для сравнения: нижний регистр, ё как е, без знаков препинания и лишних пробелов
+def normalize_answer(text: str) -> str:
+    return ' '.join(ANSWER_WORD_RE.findall(text.lower().replace('ё', 'е')))
+
+
+# Допустимые варианты перевода: "house, home" принимает оба слова
+def answer_variants(translation: str) -> List[str]:
+    variants = (normalize_answer(part) for part in ANSWER_VARIANTS_RE.split(translation))
+    return list(dict.fromkeys(variant for variant in variants if variant))
+
+
+# Сколько опечаток прощается в слове такой длины: в коротких словах одна буква меняет слово
+def allowed_typos(length: int) -> int:
+    if length <= 3:
+        return 0
+    return min(TYPED_MAX_TYPOS, 1 if length <= 7 else 2)
+
+
+# Триграммы строки с отступами по краям, как в pg_trgm: начало и конец слова дают свои триграммы
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Расстояние Дамерау-Левенштейна (перестановка соседних букв - одна ошибка) с отсечкой:
+# как только вся строка таблицы больше limit, возвращает limit + 1, не досчитывая остальное
+def bounded_edit_distance(a: str, b: str, limit: int) -> int:
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, before_previous[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+# Триграммный индекс строк: триграмма -> массив id строк. У каждой строки есть владельцы
+# (0 - общий словарь, иначе id пользователя) со счётчиком ссылок, удалённые id чистятся пересборкой
+class TrigramIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._terms: List[Optional[str]] = []
+        self._owners: List[Optional[Dict[int, int]]] = []
+        self._ids: Dict[str, int] = {}
+        self._postings: Dict[str, array] = {}
+        self._dead = 0
+        self.stats = {'searches': 0, 'candidates': 0, 'verified': 0, 'compactions': 0}
+
+    def add(self, term: str, owner: int):
+        with self._lock:
+            term_id = self._ids.get(term)
+            if term_id is None:
+                term_id = len(self._terms)
+                self._ids[term] = term_id
+                self._terms.append(sys.intern(term))
+                self._owners.append({})
+                for gram in trigrams(term):
+                    self._postings.setdefault(gram, array('I')).append(term_id)
+            owners = self._owners[term_id]
+            owners[owner] = owners.get(owner, 0) + 1
+
+    def remove(self, term: str, owner: int):
+        with self._lock:
+            term_id = self._ids.get(term)
+            if term_id is None or owner not in self._owners[term_id]:
+                return
+            owners = self._owners[term_id]
+            owners[owner] -= 1
+            if owners[owner] == 0:
+                del owners[owner]
+            if not owners:
+                del self._ids[term]
+                self._terms[term_id] = None
+                self._owners[term_id] = None
+                self._dead += 1
+                if self._dead > max(1000, len(self._ids)):
+                    self._compact()
+
+    # Пересборка без удалённых строк (вызывается под блокировкой)
+    def _compact(self):
+        live = [(term, self._owners[term_id]) for term_id, term in enumerate(self._terms) if term is not None]
+        self._terms = [term for term, _ in live]
+        self._owners = [owners for _, owners in live]
+        self._ids = {term: term_id for term_id, term in enumerate(self._terms)}
+        self._postings = {}
+        for term_id, term in enumerate(self._terms):
+            for gram in trigrams(term):
+                self._postings.setdefault(gram, array('I')).append(term_id)
+        self._dead = 0
+        self.stats['compactions'] += 1
+
+    def contains(self, term: str, owners: Tuple[int, ...]) -> bool:
+        with self._lock:
+            term_id = self._ids.get(term)
+            return term_id is not None and any(owner in self._owners[term_id] for owner in owners)
+
+    # Строки владельцев owners на расстоянии не больше max_distance, ближайшие первыми.
+    # Вставка, удаление или замена буквы портит не больше трёх триграмм, перестановка соседних - четыре,
+    # поэтому кандидат обязан разделять с запросом хотя бы len(триграмм) - 4 * max_distance триграмм -
+    # остальные строки не проверяются
+    def search(self, query: str, max_distance: int, owners: Tuple[int, ...], limit: int) -> List[Tuple[int, str]]:
+        grams = trigrams(query)
+        threshold = len(grams) - 4 * max_distance
+        results = []
+        with self._lock:
+            if threshold > 0:
+                hits = Counter()
+                for gram in grams:
+                    postings = self._postings.get(gram)
+                    if postings is not None:
+                        hits.update(postings)
+                candidates = [term_id for term_id, count in hits.items() if count >= threshold]
+            else:
+                # Запрос слишком короткий для фильтра - проверяем все строки
+                candidates = range(len(self._terms))
+            verified = 0
+            for term_id in candidates:
+                term = self._terms[term_id]
+                if term is None or abs(len(term) - len(query)) > max_distance:
+                    continue
+                if not any(owner in self._owners[term_id] for owner in owners):
+                    continue
+                verified += 1
+                distance = bounded_edit_distance(query, term, max_distance)
+                if distance <= max_distance:
+                    results.append((distance, term))
+            self.stats['searches'] += 1
+            self.stats['candidates'] += len(candidates)
+            self.stats['verified'] += verified
+        results.sort()
+        return results[:limit]
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['terms'] = len(self._ids)
+            stats['trigrams'] = len(self._postings)
+            stats['dead'] = self._dead
+        return stats
+
+
+# Словарь для проверки введённых ответов: переводы из base_words (владелец 0) и слова пользователей.
+# Общий словарь берётся из base_words_cache и перестраивается при смене снимка, слова пользователя
+# загружаются при его первом ответе и дальше меняются вместе с user_words
+class AnswerDictionary:
+    BASE_OWNER = 0
+    LOAD_ATTEMPTS = 3  # сколько раз перечитать слова пользователя, если они менялись во время загрузки
+
+    def __init__(self, max_users: int = TYPED_INDEX_USERS):
+        self.max_users = max_users
+        self.index = TrigramIndex()
+        self._base_snapshot: Optional[BaseWordsSnapshot] = None
+        self._base_terms: set = set()
+        self._base_lock = threading.Lock()
+        # user_id -> переводы пользователя в индексе, в порядке последнего обращения
+        self._users: "OrderedDict[int, List[str]]" = OrderedDict()
+        # Пользователи, чьи слова сейчас читаются из БД: user_id -> [число загрузок, число изменений слов]
+        self._loading: Dict[int, List[int]] = {}
+        self._users_lock = threading.Lock()
+
+    def _sync_base(self):
+        snapshot = base_words_cache.snapshot()
+        if snapshot is self._base_snapshot:
+            return
+        with self._base_lock:
+            if snapshot is self._base_snapshot:
+                return
+            terms = {variant for translation in snapshot.distinct_translations
+                     for variant in answer_variants(translation)}
+            for term in self._base_terms - terms:
+                self.index.remove(term, self.BASE_OWNER)
+            for term in terms - self._base_terms:
+                self.index.add(term, self.BASE_OWNER)
+            self._base_terms = terms
+            self._base_snapshot = snapshot
+
+    # Слова читаются из БД без блокировки. Если за это время слово добавили или удалили
+    # (on_word_added и другие ещё не видят пользователя в индексе), прочитанное устарело - читаем заново
+    def _load_user(self, user_id: int):
+        with self._users_lock:
+            if user_id in self._users:
+                self._users.move_to_end(user_id)
+                return
+            loading = self._loading.setdefault(user_id, [0, 0])
+            loading[0] += 1
+        try:
+            for _ in range(self.LOAD_ATTEMPTS):
+                with self._users_lock:
+                    changes = loading[1]
+                translations = get_user_translations(user_id)
+                if translations is None:
+                    return
+                with self._users_lock:
+                    if user_id in self._users:
+                        return
+                    if loading[1] != changes:
+                        continue
+                    terms = [variant for translation in translations for variant in answer_variants(translation)]
+                    for term in terms:
+                        self.index.add(term, user_id)
+                    self._users[user_id] = terms
+                    while len(self._users) > self.max_users:
+                        evicted, evicted_terms = self._users.popitem(last=False)
+                        for term in evicted_terms:
+                            self.index.remove(term, evicted)
+                    return
+        finally:
+            with self._users_lock:
+                loading[0] -= 1
+                if not loading[0]:
+                    del self._loading[user_id]
+
+    # Изменение слов пользователя, которого сейчас загружают (вызывается под _users_lock)
+    def _mark_changed(self, user_id: int):
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            loading[1] += 1
+
+    def on_word_added(self, user_id: int, translation: str):
+        with self._users_lock:
+            terms = self._users.get(user_id)
+            if terms is None:
+                self._mark_changed(user_id)
+                return
+            for term in answer_variants(translation):
+                terms.append(term)
+                self.index.add(term, user_id)
+
+    def on_word_deleted(self, user_id: int, translation: str):
+        with self._users_lock:
+            terms = self._users.get(user_id)
+            if terms is None:
+                self._mark_changed(user_id)
+                return
+            for term in answer_variants(translation):
+                if term in terms:
+                    terms.remove(term)
+                    self.index.remove(term, user_id)
+
+    # Слова пользователя поменялись массово (импорт, замена перевода) - загрузим заново при следующем ответе
+    def forget_user(self, user_id: int):
+        with self._users_lock:
+            self._mark_changed(user_id)
+            for term in self._users.pop(user_id, ()):
+                self.index.remove(term, user_id)
+
+    # Проверка ответа: ('exact' | 'typo' | 'wrong', подсказки).
+    # Опечаткой не считается ввод, который сам есть в словаре: "mouse" вместо "house" - другое слово
+    def check(self, user_id: int, answer: str, translation: str) -> Tuple[str, List[str]]:
+        text = normalize_answer(answer)
+        variants = answer_variants(translation)
+        if text in variants:
+            return 'exact', []
+        self._sync_base()
+        self._load_user(user_id)
+        owners = (self.BASE_OWNER, user_id)
+        if text and not self.index.contains(text, owners):
+            for variant in variants:
+                limit = allowed_typos(len(variant))
+                if bounded_edit_distance(text, variant, limit) <= limit:
+                    return 'typo', []
+        similar = self.index.search(text, allowed_typos(len(text)), owners, TYPED_SUGGESTIONS + len(variants) + 1)
+        suggestions = [term for _, term in similar if term != text and term not in variants]
+        return 'wrong', suggestions[:TYPED_SUGGESTIONS]
+
+    def snapshot(self) -> Dict[str, int]:
+        stats = self.index.snapshot()
+        stats['base_terms'] = len(self._base_terms)
+        stats['users'] = len(self._users)
+        return stats
+
+
+answer_dictionary = AnswerDictionary()
+
+
+# Параметры журнала ответов
+ANSWER_LOG_BATCH = int(os.getenv("ANSWER_LOG_BATCH", "500"))  # сколько событий записывать одним запросом
+ANSWER_LOG_INTERVAL = float(os.getenv("ANSWER_LOG_INTERVAL", "2"))  # как часто сбрасывать буфер, сек
+ANSWER_LOG_BUFFER = int(os.getenv("ANSWER_LOG_BUFFER", "10000"))  # максимум событий в памяти
+
+
+# Журнал ответов: события копятся в памяти и пишутся в answer_events пачками из фонового потока,
+# поэтому обработчик ответа не ждёт записи в БД
+class AnswerLog:
+    def __init__(self, batch_size: int = ANSWER_LOG_BATCH, interval: float = ANSWER_LOG_INTERVAL,
+                 max_buffer: int = ANSWER_LOG_BUFFER):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self._buffer: deque = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.stats = {'logged': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'errors': 0}
+
+    def log(self, user_id: int, word_id: Optional[int], word: str, correct: bool, retry: bool,
+            latency_ms: Optional[int]):
+        with self._cond:
+            if self._stopping:
+                return
+            if len(self._buffer) >= self.max_buffer:
+                # БД не успевает - теряем самое старое событие, но не растём в памяти
+                self._buffer.popleft()
+                self.stats['dropped'] += 1
+            self._buffer.append((user_id, word_id, word, correct, retry, latency_ms, time.time()))
+            self.stats['logged'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="answer-log", daemon=True)
+                self._thread.start()
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def _take_batch(self) -> List[Tuple]:
+        # Вызывается под self._cond
+        count = min(len(self._buffer), self.batch_size)
+        return [self._buffer.popleft() for _ in range(count)]
+
+    # Счётчики ответов по пачке: учитываются только первые попытки, серия верных ответов
+    # продолжается, если вся пачка пользователя верна, иначе начинается с хвоста пачки
+    @staticmethod
+    def _update_counters(cur, batch: List[Tuple]) -> List[Tuple]:
+        results: Dict[int, List[bool]] = {}
+        for user_id, _, _, correct, retry, _, _ in batch:
+            if not retry:
+                results.setdefault(user_id, []).append(correct)
+        if not results:
+            return []
+
+        values = []
+        for user_id, answers in results.items():
+            runs = ''.join('1' if correct else '0' for correct in answers).split('0')
+            values.append((user_id, len(answers), sum(answers), len(runs) == 1,
+                           len(runs[0]), len(runs[-1]), max(map(len, runs))))
+        ensure_user_stats(cur, list(results))
+        return execute_values(cur, f"""
+            UPDATE user_stats SET
+                answers = answers + v.batch_answers,
+                correct_answers = correct_answers + v.batch_correct,
+                streak = CASE WHEN v.all_correct THEN streak + v.batch_answers ELSE v.tail_run END,
+                best_streak = GREATEST(best_streak, streak + v.head_run, v.best_run)
+            FROM (VALUES %s) AS v(user_id, batch_answers, batch_correct, all_correct, head_run, tail_run, best_run)
+            WHERE user_stats.user_id = v.user_id
+            {USER_STATS_RETURNING}
+        """, values, page_size=len(values), fetch=True)
+
+    @timed('db', 'answer_log_write')
+    def _write(self, batch: List[Tuple]) -> bool:
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        INSERT INTO answer_events (user_id, word_id, word, correct, retry, latency_ms, answered_at)
+                        VALUES %s
+                    """, batch, template="(%s, %s, %s, %s, %s, %s, to_timestamp(%s))", page_size=len(batch))
+                    counters = self._update_counters(cur, batch)
+                    conn.commit()
+            for row in counters:
+                user_stats_cache.put(row)
+        except Exception as e:
+            log_error('answer_log', e, "Ошибка записи журнала ответов")
+            with self._cond:
+                self.stats['errors'] += 1
+                # Возвращаем пачку в начало буфера, если для неё есть место
+                room = self.max_buffer - len(self._buffer)
+                self._buffer.extendleft(reversed(batch[len(batch) - room:] if room < len(batch) else batch))
+                self.stats['dropped'] += max(0, len(batch) - room)
+            return False
+        with self._cond:
+            self.stats['written'] += len(batch)
+            self.stats['batches'] += 1
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._buffer) < self.batch_size:
+                    self._cond.wait(self.interval)
+                if self._stopping:
+                    return
+                batch = self._take_batch()
+            if batch and not self._write(batch):
+                # БД недоступна - ждём до следующей попытки
+                time.sleep(self.interval)
+
+    # Запись всего, что осталось в буфере (при остановке бота)
+    def flush(self):
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+            if not batch or not self._write(batch):
+                return
+
+    def shutdown(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._cond:
+            stats = dict(self.stats)
+            stats['buffered'] = len(self._buffer)
+        return stats
+
+
+answer_log = AnswerLog()
+
+
 # Добавление пользовательского слова
+@timed('db')
 def add_user_word(user_id: int, word: str, translation: str) -> bool:
     try:
         with db_connection() as conn:
             with conn.cursor() as cur:
+                ensure_user_stats(cur, [user_id])
                 cur.execute("""
                     INSERT INTO user_words (user_id, word, translation)
                     VALUES (%s, %s, %s)
                     ON CONFLICT (user_id, word) 
                     DO UPDATE SET translation = EXCLUDED.translation
+                    RETURNING (xmax = 0) AS inserted
                 """, (user_id, word.strip(), translation.strip()))
+                inserted = cur.fetchone()[0]
+                counters = change_words_count(cur, user_id, 1) if inserted else None
                 conn.commit()
+                if counters:
+                    user_stats_cache.put(counters)
+                card_queue.on_word_added(user_id)
+                if inserted:
+                    answer_dictionary.on_word_added(user_id, translation.strip())
+                else:
+                    # Прежний перевод неизвестен - слова пользователя перечитаются при следующем ответе
+                    answer_dictionary.forget_user(user_id)
                 return True
     except Exception as e:
-        print(f"Ошибка в add_user_word: {e}")
+        log_error('add_user_word', e)
         return False
 
 
-# Удаление пользовательского слова
-def delete_user_word(user_id: int, word: str) -> bool:
+# Все переводы слов пользователя (для словаря проверки введённых ответов)
+@timed('db')
+def get_user_translations(user_id: int) -> Optional[List[str]]:
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT translation FROM user_words WHERE user_id = %s", (user_id,))
+                return [row[0] for row in cur.fetchall()]
+    except Exception as e:
+        log_error('get_user_translations', e)
+        return None
+
+
+# Получение пользовательского слова по id
+@timed('db')
+def get_user_word(user_id: int, word_id: int) -> Optional[Tuple[str, str]]:
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT word, translation FROM user_words
+                    WHERE user_id = %s AND id = %s
+                """, (user_id, word_id))
+                return cur.fetchone()
+    except Exception as e:
+        log_error('get_user_word', e)
+        return None
+
+
+# Удаление пользовательского слова по id (возвращает удалённое слово)
+@timed('db')
+def delete_user_word(user_id: int, word_id: int) -> Optional[str]:
     try:
         with db_connection() as conn:
             with conn.cursor() as cur:
+                ensure_user_stats(cur, [user_id])
                 cur.execute("""
                     DELETE FROM user_words 
-                    WHERE user_id = %s AND word = %s
-                    RETURNING id
-                """, (user_id, word.strip()))
-                deleted = cur.fetchone() is not None
+                    WHERE user_id = %s AND id = %s
+                    RETURNING word, translation
+                """, (user_id, word_id))
+                row = cur.fetchone()
+                counters = change_words_count(cur, user_id, -1) if row else None
                 conn.commit()
-                return deleted
+                if row:
+                    user_stats_cache.put(counters)
+                    card_queue.on_word_deleted(user_id, row[0])
+                    answer_dictionary.on_word_deleted(user_id, row[1])
+                return row[0] if row else None
     except Exception as e:
-        print(f"Ошибка в delete_user_word: {e}")
-        return False
+        log_error('delete_user_word', e)
+        return None
+
 
+# Размер страницы в списках слов
+WORDS_PAGE_SIZE = int(os.getenv("WORDS_PAGE_SIZE", "15"))
 
-# Получение списка пользовательских слов
-def get_user_words(user_id: int) -> List[Tuple[str, str]]:
+
+# Страница слов пользователя по ключу (user_id, word): один ограниченный запрос по индексу
+# вместо выборки всех слов. cursor_id - id слова на границе предыдущей страницы (0 - с начала),
+# backward - страница перед этим словом. Слово-курсор находится в том же запросе подзапросом по (user_id, id).
+# Возвращает строки, признак, что дальше есть ещё слова, и признак, что курсор найден
+# (если слово-курсор удалено, возвращается первая страница)
+@timed('db')
+def get_user_words_page(user_id: int, cursor_id: int = 0, backward: bool = False, prefix: str = None,
+                        limit: int = WORDS_PAGE_SIZE) -> Tuple[List[Tuple[int, str, str]], bool, bool]:
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                # Без курсора страница вперёд начинается с '' - раньше любого слова
+                conditions = ["user_id = %s", "word < anchor.word" if backward else "word > COALESCE(anchor.word, '')"]
+                params = [user_id, cursor_id, user_id]
+                if prefix:
+                    # Диапазон - для поиска по индексу, starts_with - точная проверка префикса
+                    conditions.append("word >= %s AND word < %s AND starts_with(word, %s)")
+                    params.extend([prefix, prefix + '\U0010ffff', prefix])
+
+                cur.execute(f"""
+                    SELECT anchor.word IS NOT NULL, page.id, page.word, page.translation
+                    FROM (SELECT (SELECT word FROM user_words WHERE user_id = %s AND id = %s) AS word) AS anchor
+                    LEFT JOIN LATERAL (
+                        SELECT id, word, translation FROM user_words
+                        WHERE {' AND '.join(conditions)}
+                        ORDER BY word {'DESC' if backward else 'ASC'}
+                        LIMIT %s
+                    ) AS page ON true
+                """, params + [limit + 1])
+                result = cur.fetchall()
+        cursor_found = bool(cursor_id) and result[0][0]
+        if backward and not cursor_found:
+            # Слово-курсор удалено - начинаем с первой страницы
+            return get_user_words_page(user_id, 0, False, prefix, limit)
+        rows = [row[1:] for row in result if row[1] is not None]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backward:
+            rows.reverse()
+        return rows, has_more, cursor_found
+    except Exception as e:
+        log_error('get_user_words_page', e)
+        return [], False, False
+
+
+# Параметры импорта слов из файла
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(5 * 1024 * 1024)))
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "50000"))
+WORD_MAX_LENGTH = 100  # VARCHAR(100) в user_words
+IMPORT_HEADERS = {('word', 'translation'), ('слово', 'перевод')}
+IMPORT_SNIFF_CHARS = 64 * 1024  # по скольким символам начала файла определяется разделитель
+
+
+# Поток строк в текстовом формате COPY, читаемый copy_expert по частям
+class CopyRowStream:
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = ''
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += '\t'.join(self._escape(str(value)) for value in row) + '\n'
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+    readline = read
+
+
+# Разделитель столбцов по нескольким первым строкам: csv.Sniffer выбирает символ, который встречается
+# одинаково во всех строках (при равенстве - табуляция, затем запятая), поэтому "дом,house; home"
+# не делится по ';'. Если строки неровные - первый разделитель первой строки
+def detect_delimiter(sample: str) -> str:
+    sniffer = csv.Sniffer()
+    sniffer.preferred = ['\t', ',', ';']
+    try:
+        return sniffer.sniff(sample, delimiters=',;\t').delimiter
+    except csv.Error:
+        first_line = sample.split('\n', 1)[0]
+        if '\t' in first_line:
+            return '\t'
+        positions = [(first_line.find(delimiter), delimiter) for delimiter in ',;' if delimiter in first_line]
+        return min(positions)[1] if positions else ','
+
+
+# Построчный разбор CSV/TSV: проверенные строки (номер строки, слово, перевод) уходят в COPY,
+# отклонённые учитываются в report
+def parse_import_rows(data: bytes, report: Dict):
+    text = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', errors='replace', newline='')
+    sample = text.read(IMPORT_SNIFF_CHARS)
+    if len(sample) == IMPORT_SNIFF_CHARS and '\n' in sample:
+        # Последняя строка образца обрезана - не учитываем её
+        sample = sample[:sample.rindex('\n')]
+    delimiter = detect_delimiter(sample)
+    text.seek(0)
+
+    for line_no, row in enumerate(csv.reader(text, delimiter=delimiter), start=1):
+        values = [value.strip() for value in row]
+        if not any(values):
+            continue
+        if line_no == 1 and tuple(value.lower() for value in values[:2]) in IMPORT_HEADERS:
+            continue
+        if report['rows'] >= IMPORT_MAX_ROWS:
+            report['truncated'] = True
+            break
+        report['rows'] += 1
+        # Столбцы после перевода (например, из файла /export) не загружаются
+        values = values[:2]
+        if len(values) != 2 or not all(values) or max(map(len, values)) > WORD_MAX_LENGTH:
+            report['rejected'] += 1
+            if len(report['rejected_lines']) < 5:
+                report['rejected_lines'].append(line_no)
+            continue
+        yield line_no, values[0], values[1]
+
+
+# Массовый импорт слов: COPY во временную таблицу и одно слияние с user_words
+@timed('db')
+def import_user_words(user_id: int, data: bytes) -> Optional[Dict]:
+    report = {'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'duplicates': 0,
+              'rejected': 0, 'rejected_lines': [], 'truncated': False}
     try:
         with db_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
-                    SELECT word, translation FROM user_words 
-                    WHERE user_id = %s
-                    ORDER BY word
+                    CREATE TEMP TABLE import_words (
+                        line_no INTEGER NOT NULL,
+                        word VARCHAR(100) NOT NULL,
+                        translation VARCHAR(100) NOT NULL
+                    ) ON COMMIT DROP
+                """)
+                cur.copy_expert(
+                    "COPY import_words (line_no, word, translation) FROM STDIN",
+                    CopyRowStream(parse_import_rows(data, report))
+                )
+                ensure_user_stats(cur, [user_id])
+                # Повторы слова внутри файла: побеждает последняя строка
+                cur.execute("""
+                    WITH staged AS (
+                        SELECT DISTINCT ON (word) word, translation
+                        FROM import_words
+                        ORDER BY word, line_no DESC
+                    ), merged AS (
+                        INSERT INTO user_words (user_id, word, translation)
+                        SELECT %s, word, translation FROM staged
+                        ON CONFLICT (user_id, word)
+                        DO UPDATE SET translation = EXCLUDED.translation
+                        WHERE user_words.translation IS DISTINCT FROM EXCLUDED.translation
+                        RETURNING (xmax = 0) AS inserted
+                    )
+                    SELECT
+                        (SELECT COUNT(*) FROM import_words),
+                        (SELECT COUNT(*) FROM staged),
+                        COUNT(*) FILTER (WHERE inserted),
+                        COUNT(*) FILTER (WHERE NOT inserted)
+                    FROM merged
                 """, (user_id,))
-                return cur.fetchall()
+                staged_count, distinct_count, report['inserted'], report['updated'] = cur.fetchone()
+                counters = change_words_count(cur, user_id, report['inserted']) if report['inserted'] else None
+                conn.commit()
+        if counters:
+            user_stats_cache.put(counters)
+        report['duplicates'] = staged_count - distinct_count
+        report['unchanged'] = distinct_count - report['inserted'] - report['updated']
+        if report['inserted'] or report['updated']:
+            card_queue.on_word_added(user_id)
+            answer_dictionary.forget_user(user_id)
+        return report
     except Exception as e:
-        print(f"Ошибка в get_user_words: {e}")
-        return []
+        log_error('import_user_words', e)
+        return None
+
+
+# Параметры выгрузки слов
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "2000"))
+EXPORT_FORMATS = ('csv', 'json')
+EXPORT_COLUMNS = ('word', 'translation', 'created_at', 'ease', 'interval_days', 'repetitions', 'due_at', 'reviewed_at')
+EXPORT_QUERY = """
+    SELECT word, translation, created_at, ease, interval_days, repetitions, due_at, reviewed_at
+    FROM user_words
+    WHERE user_id = %s
+    ORDER BY id
+"""
+
+
+# Значение для файла выгрузки: даты - в виде "ГГГГ-ММ-ДД чч:мм:сс"
+def export_value(value):
+    return value.isoformat(sep=' ', timespec='seconds') if hasattr(value, 'isoformat') else value
+
+
+# Запись строк курсора в файл: CSV с заголовком или JSON-массив объектов, по одной строке за раз
+def write_export_rows(rows, out, export_format: str) -> int:
+    count = 0
+    text = io.TextIOWrapper(out, encoding='utf-8-sig' if export_format == 'csv' else 'utf-8', newline='')
+    if export_format == 'csv':
+        writer = csv.writer(text)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(export_value(value) for value in row)
+            count += 1
+    else:
+        text.write('[')
+        for row in rows:
+            item = dict(zip(EXPORT_COLUMNS, row))
+            text.write(',\n' if count else '\n')
+            text.write(json.dumps(item, ensure_ascii=False, default=export_value))
+            count += 1
+        text.write('\n]\n')
+    text.flush()
+    text.detach()
+    return count
+
+
+# Выгрузка слов пользователя во временный файл через серверный курсор:
+# строки читаются пачками по EXPORT_FETCH_SIZE, поэтому память не зависит от размера словаря
+@timed('db')
+def export_user_words(user_id: int, export_format: str) -> Optional[Tuple[object, int]]:
+    out = tempfile.TemporaryFile()
+    try:
+        with db_connection() as conn:
+            try:
+                with conn.cursor(name='export_user_words') as cur:
+                    cur.itersize = EXPORT_FETCH_SIZE
+                    cur.execute(EXPORT_QUERY, (user_id,))
+                    count = write_export_rows(cur, out, export_format)
+            finally:
+                conn.rollback()
+        out.seek(0)
+        return out, count
+    except Exception as e:
+        out.close()
+        log_error('export_user_words', e)
+        return None
 
 
 # Приветственное сообщение
@@ -217,337 +2072,1878 @@ WELCOME_MESSAGE = """
 
 📌 Что ты можешь:
 - 🔤 Начать тренировку — получить карточку и выбрать перевод.
+- ⌨️ Тренировка с вводом — написать перевод самому (небольшие опечатки прощаются).
 - 📚 Посмотреть свои слова — проверить, что уже добавил.
 - ➕ Добавить слово — самостоятельно пополнять базу.
 - ➖ Удалить слово — управлять своей коллекцией.
+- 📥 Загрузить сразу много слов из файла CSV — подробнее: /import
+- 📤 Выгрузить свои слова в файл — /export (или /export json)
 
 Ну что, начнём? 😉
 """
 
 
+# Кодирование callback_data: версия, код операции и числовые аргументы, например "1a:4821:2".
+# Слова в callback_data не передаются: ограничение Telegram - 64 байта
+CALLBACK_VERSION = '1'
+OP_START_QUIZ = 'q'
+OP_ANSWER = 'a'
+OP_MY_WORDS = 'w'
+OP_ADD_WORD = 'n'
+OP_DELETE_WORD = 'r'
+OP_ASK_DELETE = 'd'
+OP_CONFIRM_DELETE = 'x'
+OP_CANCEL_DELETE = 'c'
+OP_MAIN_MENU = 'm'
+OP_WORDS_PAGE = 'p'
+OP_WORDS_SEARCH = 's'
+OP_WORDS_RESET = 'z'
+OP_STATS = 't'
+OP_TYPED_QUIZ = 'k'
+OP_TYPED_REVEAL = 'v'
+OP_STALE = '_'
+
+# callback_data кнопок из сообщений, отправленных до появления кодирования
+LEGACY_CALLBACKS = {
+    'start_quiz': OP_START_QUIZ,
+    'my_words': OP_MY_WORDS,
+    'add_word': OP_ADD_WORD,
+    'delete_word': OP_DELETE_WORD,
+    'cancel_delete': OP_CANCEL_DELETE,
+    'main_menu': OP_MAIN_MENU,
+}
+
+
+def encode_callback(opcode: str, *args: int) -> str:
+    return CALLBACK_VERSION + opcode + ''.join(f':{arg}' for arg in args)
+
+
+# Разбор callback_data в (код операции, аргументы); неизвестный формат - устаревшая кнопка
+def decode_callback(data: str) -> Tuple[str, List[int]]:
+    if data in LEGACY_CALLBACKS:
+        return LEGACY_CALLBACKS[data], []
+    if len(data) < 2 or data[0] != CALLBACK_VERSION:
+        return OP_STALE, []
+    try:
+        return data[1], [int(arg) for arg in data[2:].split(':')[1:]]
+    except ValueError:
+        return OP_STALE, []
+
+
+# Шаблон клавиатуры: JSON собирается один раз, при отправке подставляются только изменяемые строки.
+# telebot передаёт строку reply_markup в Telegram как есть
+MARKUP_SLOT = '\uffff'
+
+
+class MarkupTemplate:
+    def __init__(self, markup: types.InlineKeyboardMarkup):
+        self._parts = markup.to_json().split(json.dumps(MARKUP_SLOT)[1:-1])
+
+    def render(self, *values: str) -> str:
+        chunks = [self._parts[0]]
+        for value, part in zip(values, self._parts[1:]):
+            chunks.append(encode_basestring(value)[1:-1])
+            chunks.append(part)
+        return ''.join(chunks)
+
+
 # Главное меню с inline-кнопками
-def main_menu() -> types.InlineKeyboardMarkup:
+def build_main_menu() -> types.InlineKeyboardMarkup:
     markup = types.InlineKeyboardMarkup(row_width=2)
     markup.add(
-        types.InlineKeyboardButton('🔤 Начать тренировку', callback_data='start_quiz'),
-        types.InlineKeyboardButton('📚 Мои слова', callback_data='my_words'),
-        types.InlineKeyboardButton('➕ Добавить слово', callback_data='add_word'),
-        types.InlineKeyboardButton('➖ Удалить слово', callback_data='delete_word')
+        types.InlineKeyboardButton('🔤 Начать тренировку', callback_data=encode_callback(OP_START_QUIZ)),
+        types.InlineKeyboardButton('📚 Мои слова', callback_data=encode_callback(OP_MY_WORDS)),
+        types.InlineKeyboardButton('➕ Добавить слово', callback_data=encode_callback(OP_ADD_WORD)),
+        types.InlineKeyboardButton('➖ Удалить слово', callback_data=encode_callback(OP_DELETE_WORD)),
+        types.InlineKeyboardButton('⌨️ Тренировка с вводом', callback_data=encode_callback(OP_TYPED_QUIZ)),
+        types.InlineKeyboardButton('📊 Статистика', callback_data=encode_callback(OP_STATS))
+    )
+    return markup
+
 
+# Клавиатура после правильного ответа
+def build_next_card_markup() -> types.InlineKeyboardMarkup:
+    markup = types.InlineKeyboardMarkup()
+    markup.add(
+        types.InlineKeyboardButton("➡️ Следующее слово", callback_data=encode_callback(OP_START_QUIZ)),
+        types.InlineKeyboardButton("🏠 В главное меню", callback_data=encode_callback(OP_MAIN_MENU))
     )
     return markup
 
 
-# Клавиатура с вариантами ответов
-def create_card_markup(target_word: str, other_words: List[str]) -> types.InlineKeyboardMarkup:
-    buttons = [types.InlineKeyboardButton(word, callback_data=f"answer_{word}")
-               for word in [target_word] + other_words]
-    random.shuffle(buttons)
-    return types.InlineKeyboardMarkup(row_width=2).add(*buttons)
+# Клавиатура после ответа в тренировке с вводом
+def build_next_typed_markup() -> types.InlineKeyboardMarkup:
+    markup = types.InlineKeyboardMarkup()
+    markup.add(
+        types.InlineKeyboardButton("➡️ Следующее слово", callback_data=encode_callback(OP_TYPED_QUIZ)),
+        types.InlineKeyboardButton("🏠 В главное меню", callback_data=encode_callback(OP_MAIN_MENU))
+    )
+    return markup
 
 
-# Клавиатура подтверждения удаления
-def confirm_delete_markup(word: str) -> types.InlineKeyboardMarkup:
+# Клавиатура карточки с вводом перевода (токен карточки - в шаблоне)
+def build_typed_card_markup() -> types.InlineKeyboardMarkup:
     markup = types.InlineKeyboardMarkup()
     markup.add(
-        types.InlineKeyboardButton("✅ Да, удалить", callback_data=f"confirm_del_{word}"),
-        types.InlineKeyboardButton("❌ Нет, отмена", callback_data="cancel_delete")
+        types.InlineKeyboardButton("💡 Показать ответ", callback_data=encode_callback(OP_TYPED_REVEAL) + MARKUP_SLOT),
+        types.InlineKeyboardButton("🏠 В главное меню", callback_data=encode_callback(OP_MAIN_MENU))
     )
     return markup
 
 
+# Клавиатура подтверждения удаления (id слова - в шаблоне)
+def build_confirm_delete_markup() -> types.InlineKeyboardMarkup:
+    markup = types.InlineKeyboardMarkup()
+    markup.add(
+        types.InlineKeyboardButton("✅ Да, удалить", callback_data=encode_callback(OP_CONFIRM_DELETE) + MARKUP_SLOT),
+        types.InlineKeyboardButton("❌ Нет, отмена", callback_data=encode_callback(OP_CANCEL_DELETE))
+    )
+    return markup
+
+
+# Клавиатура с вариантами ответов: текст кнопки и токен карточки в callback_data - в шаблоне,
+# номер варианта в callback_data постоянный
+def build_card_markup(options_count: int) -> types.InlineKeyboardMarkup:
+    buttons = [types.InlineKeyboardButton(MARKUP_SLOT, callback_data=encode_callback(OP_ANSWER, MARKUP_SLOT, i))
+               for i in range(options_count)]
+    return types.InlineKeyboardMarkup(row_width=2).add(*buttons)
+
+
+# Неизменные клавиатуры сериализуются один раз при запуске
+MAIN_MENU_MARKUP = build_main_menu().to_json()
+NEXT_CARD_MARKUP = build_next_card_markup().to_json()
+NEXT_TYPED_MARKUP = build_next_typed_markup().to_json()
+TYPED_CARD_TEMPLATE = MarkupTemplate(build_typed_card_markup())
+CONFIRM_DELETE_TEMPLATE = MarkupTemplate(build_confirm_delete_markup())
+CARD_MARKUP_TEMPLATES = {count: MarkupTemplate(build_card_markup(count)) for count in range(1, DISTRACTORS_COUNT + 2)}
+
+
+def main_menu() -> str:
+    return MAIN_MENU_MARKUP
+
+
+# Варианты ответа в порядке кнопок и индекс правильного
+def shuffle_card_options(target_word: str, other_words: List[str]) -> Tuple[List[str], int]:
+    # Добираем недостающие варианты из кэша базовых слов
+    if len(other_words) < DISTRACTORS_COUNT:
+        other_words = other_words + base_words_cache.sample_distractors(
+            target_word, DISTRACTORS_COUNT - len(other_words), exclude=other_words)
+    options = [target_word] + other_words
+    random.shuffle(options)
+    return options, options.index(target_word)
+
+
+# Клавиатура с вариантами ответов: в кнопке только токен карточки и номер варианта
+def create_card_markup(card_token: int, options: List[str]) -> str:
+    token = str(card_token)
+    values = []
+    for word in options:
+        values.append(word)
+        values.append(token)
+    return CARD_MARKUP_TEMPLATES[len(options)].render(*values)
+
+
+def next_card_markup() -> str:
+    return NEXT_CARD_MARKUP
+
+
+def confirm_delete_markup(word_id: int) -> str:
+    return CONFIRM_DELETE_TEMPLATE.render(f':{word_id}')
+
+
+def next_typed_markup() -> str:
+    return NEXT_TYPED_MARKUP
+
+
+def typed_card_markup(card_token: int) -> str:
+    return TYPED_CARD_TEMPLATE.render(f':{card_token}')
+
+
+# Синхронный TeleBot с интерфейсом AsyncTeleBot: обработчики пишутся один раз, как корутины
+class SyncBotAdapter:
+    def __init__(self, sync_bot: telebot.TeleBot):
+        self._bot = sync_bot
+
+    def __getattr__(self, name):
+        method = getattr(self._bot, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+
+# Выполнение корутины-обработчика в режиме sync: она ни разу не приостанавливается,
+# так как и api, и run_db отвечают синхронно, поэтому event loop не нужен
+def run_sync(coro):
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("Обработчик приостановился в синхронном режиме")
+
+
+# Параметры очереди исходящих запросов к Telegram
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))  # сообщений в секунду на всего бота
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))  # сообщений в секунду в личный чат
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))  # сообщений в секунду в группу
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))  # сколько сообщений подряд можно отправить в чат
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))  # повторов после ответа 429
+SEND_MAX_CHATS = 10000  # для скольких чатов помнить ограничение скорости
+
+# Методы, на которые действуют ограничения Telegram; остальные (answer_callback_query, get_file)
+# вызываются сразу
+QUEUED_METHODS = {'send_message', 'edit_message_text', 'edit_message_reply_markup', 'send_document'}
+# Правки одного сообщения, которые можно заменить более поздней правкой, пока они ждут отправки
+COALESCED_METHODS = {'edit_message_text', 'edit_message_reply_markup'}
+# Методы Bot API, которые обработчики вызывают напрямую (для метрик)
+DIRECT_METHODS = {'answer_callback_query', 'get_file', 'download_file'}
+
+
+# Ведро токенов: rate токенов в секунду, не больше burst подряд
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    # Сколько секунд ждать до следующего токена (0 - токен есть)
+    def wait_time(self, now: float) -> float:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+# Запрос к Telegram в очереди: все, кто ждёт его результата (несколько при объединении правок)
+class OutboundCall:
+    __slots__ = ('method', 'args', 'kwargs', 'futures', 'retries', 'coalesce_key')
+
+    def __init__(self, method: str, args: tuple, kwargs: dict, coalesce_key=None):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.futures: List[Future] = [Future()]
+        self.retries = 0
+        self.coalesce_key = coalesce_key
+
+    # Подготовка к повтору: файлы, уже прочитанные при отправке, перематываются в начало.
+    # Если файл перемотать нельзя, повтор отправил бы пустой файл - тогда возвращается False
+    def rewind(self) -> bool:
+        for value in list(self.args) + list(self.kwargs.values()):
+            if not hasattr(value, 'read'):
+                continue
+            if not (hasattr(value, 'seekable') and value.seekable()):
+                return False
+            value.seek(0)
+        return True
+
+
+# Очередь исходящих запросов: общее ограничение скорости и ограничение на чат, повтор после 429
+# с retry_after, объединение ещё не отправленных правок одного сообщения.
+# Запросы одного чата уходят строго по порядку, разных чатов - параллельно в SEND_WORKERS потоках
+class OutboundDispatcher:
+    def __init__(self, sync_bot: telebot.TeleBot, workers: int = SEND_WORKERS):
+        self._bot = sync_bot
+        self._global = TokenBucket(SEND_GLOBAL_RATE, SEND_GLOBAL_RATE)
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._chats: Dict[int, deque] = {}  # chat_id -> запросы в порядке отправки
+        self._ready: deque = deque()  # чаты с запросами, которые можно отправлять
+        self._delayed: List[Tuple[float, int]] = []  # куча (когда можно, chat_id) для ждущих чатов
+        self._busy = set()  # чаты, запрос которых сейчас выполняется
+        self._cond = threading.Condition()
+        self._workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self.stats = {'queued': 0, 'sent': 0, 'coalesced': 0, 'retries': 0, 'failed': 0, 'throttled': 0}
+
+    # Общий лимит отправки в секунду (воркеру супервизора достаётся доля SEND_GLOBAL_RATE)
+    def set_global_rate(self, rate: float):
+        with self._cond:
+            self._global = TokenBucket(rate, rate)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate = SEND_GROUP_RATE if chat_id < 0 else SEND_CHAT_RATE
+            bucket = self._buckets[chat_id] = TokenBucket(rate, SEND_CHAT_BURST)
+            while len(self._buckets) > SEND_MAX_CHATS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chat_id)
+        return bucket
+
+    def submit(self, method: str, args: tuple, kwargs: dict) -> Future:
+        chat_id = int(kwargs['chat_id'] if 'chat_id' in kwargs else args[0])
+        coalesce_key = None
+        if method in COALESCED_METHODS and 'message_id' in kwargs:
+            coalesce_key = (method, kwargs['message_id'])
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("Очередь отправки остановлена")
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="outbound")
+                self._thread = threading.Thread(target=self._run, name="outbound-scheduler", daemon=True)
+                self._thread.start()
+            self.stats['queued'] += 1
+            pending = self._chats.get(chat_id)
+            if coalesce_key is not None and pending:
+                for call in pending:
+                    if call.coalesce_key == coalesce_key:
+                        # Правка ещё не ушла - отправим сразу новое содержимое, результат получат оба
+                        call.args, call.kwargs = args, kwargs
+                        call.futures.append(Future())
+                        self.stats['coalesced'] += 1
+                        return call.futures[-1]
+            call = OutboundCall(method, args, kwargs, coalesce_key)
+            if pending is None:
+                pending = self._chats[chat_id] = deque()
+            pending.append(call)
+            if len(pending) == 1 and chat_id not in self._busy:
+                self._ready.append(chat_id)
+                self._cond.notify()
+            return call.futures[0]
+
+    # Следующий чат, которому можно отправить запрос, или сколько ждать (вызывается под self._cond)
+    def _next_chat(self, now: float) -> Tuple[Optional[int], Optional[float]]:
+        while self._delayed and self._delayed[0][0] <= now:
+            self._ready.append(heapq.heappop(self._delayed)[1])
+        if self._ready:
+            global_wait = self._global.wait_time(now)
+            if global_wait > 0:
+                return None, global_wait
+        while self._ready:
+            chat_id = self._ready.popleft()
+            chat_wait = self._chat_bucket(chat_id).wait_time(now)
+            if chat_wait > 0:
+                self.stats['throttled'] += 1
+                heapq.heappush(self._delayed, (now + chat_wait, chat_id))
+                continue
+            return chat_id, None
+        return None, (self._delayed[0][0] - now) if self._delayed else None
+
+    def _run(self):
+        with self._cond:
+            while True:
+                chat_id, wait = self._next_chat(time.monotonic())
+                if chat_id is None:
+                    if self._stopping and not self._chats and not self._busy:
+                        return
+                    self._cond.wait(wait)
+                    continue
+                self._global.take()
+                self._chat_bucket(chat_id).take()
+                self._busy.add(chat_id)
+                self._executor.submit(self._execute, chat_id, self._chats[chat_id].popleft())
+
+    def _execute(self, chat_id: int, call: OutboundCall):
+        retry_after = None
+        try:
+            method = getattr(self._bot, call.method)
+            if METRICS_ENABLED:
+                method = timed('telegram', call.method)(method)
+            result = method(*call.args, **call.kwargs)
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code == 429 and call.retries < SEND_MAX_RETRIES:
+                if call.rewind():
+                    retry_after = float((e.result_json.get('parameters') or {}).get('retry_after', 1))
+                else:
+                    self._finish(call, error=RuntimeError(
+                        f"{call.method}: файл уже прочитан и не может быть отправлен повторно"))
+            else:
+                self._finish(call, error=e)
+        except Exception as e:
+            self._finish(call, error=e)
+        else:
+            self._finish(call, result=result)
+
+        with self._cond:
+            self._busy.discard(chat_id)
+            pending = self._chats.get(chat_id)
+            if retry_after is not None:
+                # Telegram просит подождать: запрос возвращается в начало очереди чата
+                call.retries += 1
+                self.stats['retries'] += 1
+                pending.appendleft(call)
+                heapq.heappush(self._delayed, (time.monotonic() + retry_after, chat_id))
+            elif pending:
+                self._ready.append(chat_id)
+            else:
+                self._chats.pop(chat_id, None)
+            self._cond.notify()
+
+    def _finish(self, call: OutboundCall, result=None, error: Exception = None):
+        with self._cond:
+            self.stats['failed' if error else 'sent'] += 1
+        for future in call.futures:
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    # Остановка: новые запросы не ждём, уже поставленные в очередь отправляем
+    def shutdown(self, timeout: float = 10):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            self._executor.shutdown(wait=True)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._cond:
+            stats = dict(self.stats)
+            stats['pending'] = sum(len(pending) for pending in self._chats.values())
+            stats['chats'] = len(self._chats)
+        return stats
+
+
+outbound = OutboundDispatcher(bot)
+
+
+# Клиент Telegram API для обработчиков: сообщения и правки идут через очередь outbound,
+# остальные методы - напрямую. В режиме async результат очереди ожидается без блокировки event loop
+class OutboundBotAdapter:
+    def __init__(self, client, dispatcher: OutboundDispatcher):
+        self._client = client
+        self._dispatcher = dispatcher
+
+    def __getattr__(self, name):
+        if name not in QUEUED_METHODS:
+            attribute = getattr(self._client, name)
+            return timed('telegram', name)(attribute) if name in DIRECT_METHODS else attribute
+        dispatcher = self._dispatcher
+
+        async def call(*args, **kwargs):
+            future = dispatcher.submit(name, args, kwargs)
+            if BOT_MODE == 'async':
+                return await asyncio.wrap_future(future)
+            return future.result()
+        return call
+
+
+# Клиент Telegram API для обработчиков
+if BOT_MODE == 'async':
+    from telebot import asyncio_helper
+    from telebot.async_telebot import AsyncTeleBot
+    if os.getenv("TELEGRAM_API_URL"):
+        asyncio_helper.API_URL = os.getenv("TELEGRAM_API_URL") + "/bot{0}/{1}"
+        asyncio_helper.FILE_URL = os.getenv("TELEGRAM_API_URL") + "/file/bot{0}/{1}"
+    api = OutboundBotAdapter(AsyncTeleBot(os.getenv("TELEGRAM_BOT_TOKEN")), outbound)
+else:
+    api = OutboundBotAdapter(SyncBotAdapter(bot), outbound)
+
+
+# Закрытие HTTP-сессии AsyncTeleBot; если бот ещё ни разу не обращался к API, сессии нет
+async def close_api_session():
+    if asyncio_helper.session_manager.session is not None:
+        await api.close_session()
+
+
 # Отправка карточки с вопросом
-def send_card(chat_id: int, word_data: dict, edit_message_id: int = None):
+async def send_card(chat_id: int, word_data: dict, edit_message_id: int = None):
     question = word_data['word']
     translation = word_data['translation']
     other_words = word_data['other_words']
 
-    markup = create_card_markup(translation, other_words)
+    options, correct_index = shuffle_card_options(translation, other_words)
+    # Токен отличает кнопки этой карточки от кнопок прежних карточек
+    card_token = random.getrandbits(20)
+    markup = create_card_markup(card_token, options)
 
-    # Сохраняем данные перед отправкой
-    user_data[chat_id] = {
-        'correct_answer': translation,
-        'question': question,
-        'other_words': other_words,
-        'message_id': None,
-        'previous_word': question  # Сохраняем текущее слово для проверки на повторение
-    }
+    # Новая карточка заменяет всё прежнее состояние чата
+    session = Session(
+        chat_id,
+        correct_answer=translation,
+        question=question,
+        other_words=other_words,
+        card_token=card_token,
+        options=options,
+        correct_index=correct_index,
+        word_id=word_data.get('id'),
+        failed=word_data.get('failed'),
+        sent_at=time.time(),
+        previous_word=question  # Сохраняем текущее слово для проверки на повторение
+    )
 
     # Отправляем или редактируем сообщение с вопросом
     if edit_message_id:
         try:
-            sent_msg = bot.edit_message_text(
+            sent_msg = await api.edit_message_text(
                 chat_id=chat_id,
                 message_id=edit_message_id,
                 text=f"Как переводится слово:\n🇷🇺 *{question}*",
                 reply_markup=markup,
                 parse_mode="Markdown"
             )
-            user_data[chat_id]['message_id'] = edit_message_id
+            session.message_id = edit_message_id
         except Exception as e:
-            print(f"Ошибка при редактировании сообщения: {e}")
-            sent_msg = bot.send_message(
+            log_error('edit_message_text', e, "Ошибка при редактировании сообщения")
+            sent_msg = await api.send_message(
                 chat_id,
                 f"Как переводится слово:\n🇷🇺 *{question}*",
                 reply_markup=markup,
                 parse_mode="Markdown"
             )
-            user_data[chat_id]['message_id'] = sent_msg.message_id
+            session.message_id = sent_msg.message_id
     else:
-        sent_msg = bot.send_message(
+        sent_msg = await api.send_message(
             chat_id,
             f"Как переводится слово:\n🇷🇺 *{question}*",
             reply_markup=markup,
             parse_mode="Markdown"
         )
-        user_data[chat_id]['message_id'] = sent_msg.message_id
+        session.message_id = sent_msg.message_id
+
+    await save_session(session)
+
+
+# Шаг сессии: ждём введённый перевод карточки
+TYPED_ANSWER_STEP = 'typed_answer'
+
+
+# Отправка карточки, на которую нужно ответить сообщением с переводом
+async def send_typed_card(chat_id: int, word_data: dict):
+    question = word_data['word']
+    card_token = random.getrandbits(20)
+    session = Session(
+        chat_id,
+        correct_answer=word_data['translation'],
+        question=question,
+        card_token=card_token,
+        word_id=word_data.get('id'),
+        sent_at=time.time(),
+        previous_word=question,
+        input_step=TYPED_ANSWER_STEP
+    )
+    sent_msg = await api.send_message(
+        chat_id,
+        f"Напишите перевод слова:\n🇷🇺 *{question}*",
+        reply_markup=typed_card_markup(card_token),
+        parse_mode="Markdown"
+    )
+    session.message_id = sent_msg.message_id
+    await save_session(session)
 
 
 # Обработчик команды /start
-@bot.message_handler(commands=["start", "help"])
-def send_welcome(message: types.Message):
+async def send_welcome(message: types.Message):
     try:
-        user_id = get_or_create_user(message.from_user)
+        user_id = await run_db(get_or_create_user, message.from_user)
         if not user_id:
             raise Exception("Не удалось создать/получить пользователя")
-        bot.send_message(message.chat.id, WELCOME_MESSAGE, reply_markup=main_menu())
+        await api.send_message(message.chat.id, WELCOME_MESSAGE, reply_markup=main_menu())
     except Exception as e:
-        print(f"Ошибка в send_welcome: {e}")
-        bot.send_message(message.chat.id, "⚠️ Произошла ошибка. Попробуйте позже.")
+        log_error('send_welcome', e)
+        await api.send_message(message.chat.id, "⚠️ Произошла ошибка. Попробуйте позже.")
 
 
 # Обработчик запроса русского слова для добавления
-def ask_for_russian_word(chat_id: int):
-    msg = bot.send_message(
+@timed('step')
+async def ask_for_russian_word(chat_id: int):
+    await api.send_message(
         chat_id,
         "📝 Введите слово, которое хотите добавить, на русском языке:",
         reply_markup=types.ForceReply()
     )
-    bot.register_next_step_handler(msg, process_russian_word)
+    session = await load_session(chat_id, create=True)
+    session.input_step = 'word'
+    await save_session(session)
 
 
 # Обработчик русского слова
-def process_russian_word(message: types.Message):
+@timed('step')
+async def process_russian_word(message: types.Message):
     chat_id = message.chat.id
     russian_word = message.text.strip()
 
     if not russian_word:
-        bot.send_message(chat_id, "❌ Слово не может быть пустым. Попробуйте снова.", reply_markup=main_menu())
+        await api.send_message(chat_id, "❌ Слово не может быть пустым. Попробуйте снова.", reply_markup=main_menu())
         return
 
     # Сохраняем русское слово во временных данных
-    if chat_id not in user_data:
-        user_data[chat_id] = {}
-    user_data[chat_id]['adding_word'] = russian_word
+    session = await load_session(chat_id, create=True)
+    session.adding_word = russian_word
 
     # Запрашиваем перевод
-    msg = bot.send_message(
+    await api.send_message(
         chat_id,
         f"Теперь введите перевод для слова '{russian_word}':",
         reply_markup=types.ForceReply()
     )
-    bot.register_next_step_handler(msg, process_translation)
+    session.input_step = 'translation'
+    await save_session(session)
 
 
 # Обработчик перевода слова
-def process_translation(message: types.Message):
+@timed('step')
+async def process_translation(message: types.Message):
     chat_id = message.chat.id
     translation = message.text.strip()
 
     if not translation:
-        bot.send_message(chat_id, "❌ Перевод не может быть пустым. Попробуйте снова.", reply_markup=main_menu())
+        await api.send_message(chat_id, "❌ Перевод не может быть пустым. Попробуйте снова.", reply_markup=main_menu())
         return
 
     # Получаем сохраненное русское слово
-    russian_word = user_data.get(chat_id, {}).get('adding_word')
+    session = await load_session(chat_id)
+    russian_word = session.adding_word if session else None
     if not russian_word:
-        bot.send_message(chat_id, "❌ Не удалось найти исходное слово. Попробуйте снова.", reply_markup=main_menu())
+        await api.send_message(chat_id, "❌ Не удалось найти исходное слово. Попробуйте снова.", reply_markup=main_menu())
         return
 
-    user_id = get_or_create_user(message.from_user)
+    user_id = await run_db(get_or_create_user, message.from_user)
     if not user_id:
-        bot.send_message(chat_id, "❌ Ошибка пользователя", reply_markup=main_menu())
+        await api.send_message(chat_id, "❌ Ошибка пользователя", reply_markup=main_menu())
         return
 
-    if add_user_word(user_id, russian_word, translation):
-        # Получаем количество слов пользователя
-        words_count = get_user_words_count(user_id)
-        bot.send_message(
+    if await run_db(add_user_word, user_id, russian_word, translation):
+        # Счётчик слов уже обновлён при добавлении и лежит в кэше
+        counters = await run_db(get_user_stats, user_id)
+        await api.send_message(
             chat_id,
             f"✅ Слово '{russian_word}' с переводом '{translation}' успешно добавлено!\n"
-            f"📊 Теперь вы изучаете слов: {words_count}",
+            f"📊 Теперь вы изучаете слов: {counters['words_count'] if counters else '?'}",
             reply_markup=main_menu()
         )
     else:
-        bot.send_message(chat_id, f"❌ Не удалось добавить слово '{russian_word}'", reply_markup=main_menu())
+        await api.send_message(chat_id, f"❌ Не удалось добавить слово '{russian_word}'", reply_markup=main_menu())
 
     # Очищаем временные данные
-    if chat_id in user_data and 'adding_word' in user_data[chat_id]:
-        del user_data[chat_id]['adding_word']
+    session.adding_word = None
+    await save_session(session)
 
 
-# Обработчик inline-кнопок
-@bot.callback_query_handler(func=lambda call: True)
-def handle_callback_query(call: types.CallbackQuery):
-    chat_id = call.message.chat.id
-    user = call.from_user
-    user_id = get_or_create_user(user)
+# Обработчик текстовых сообщений: ответ на запрос слова, перевода или строки поиска
+async def handle_text_message(message: types.Message):
+    session = await load_session(message.chat.id)
+    if not session or not session.input_step:
+        return
+
+    # Шаг ожидается один раз, как у next_step_handler
+    step = session.input_step
+    session.input_step = None
+    await save_session(session)
+    if step == 'word':
+        await process_russian_word(message)
+    elif step == 'translation':
+        await process_translation(message)
+    elif step == TYPED_ANSWER_STEP:
+        await process_typed_answer(message)
+    elif step in (WORDS_SEARCH_STEPS[WORDS_VIEW], WORDS_SEARCH_STEPS[WORDS_DELETE]):
+        await process_words_search(message, WORDS_SEARCH_STEPS.index(step))
+
+
+# Режимы списка слов: просмотр и выбор слова для удаления
+WORDS_VIEW = 0
+WORDS_DELETE = 1
+WORDS_SEARCH_STEPS = ['search_view', 'search_delete']
+
+
+# Клавиатура страницы списка слов: слова (в режиме удаления), навигация, поиск
+def words_page_markup(mode: int, rows: List[Tuple[int, str, str]], has_prev: bool, has_next: bool,
+                      prefix: Optional[str]) -> types.InlineKeyboardMarkup:
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    if mode == WORDS_DELETE:
+        for word_id, word, _ in rows:
+            markup.row(types.InlineKeyboardButton(word, callback_data=encode_callback(OP_ASK_DELETE, word_id)))
+    navigation = []
+    if has_prev:
+        navigation.append(types.InlineKeyboardButton(
+            "◀️ Назад", callback_data=encode_callback(OP_WORDS_PAGE, mode, 1, rows[0][0])))
+    if has_next:
+        navigation.append(types.InlineKeyboardButton(
+            "Вперёд ▶️", callback_data=encode_callback(OP_WORDS_PAGE, mode, 0, rows[-1][0])))
+    if navigation:
+        markup.row(*navigation)
+    if prefix:
+        markup.row(types.InlineKeyboardButton("✖️ Сбросить поиск", callback_data=encode_callback(OP_WORDS_RESET, mode)))
+    else:
+        markup.row(types.InlineKeyboardButton("🔎 Поиск", callback_data=encode_callback(OP_WORDS_SEARCH, mode)))
+    markup.row(types.InlineKeyboardButton("🏠 В главное меню", callback_data=encode_callback(OP_MAIN_MENU)))
+    return markup
+
 
+# Отправка (или замена в том же сообщении) страницы списка слов
+async def send_words_page(chat_id: int, user_id: int, mode: int, cursor_id: int = 0, backward: bool = False,
+                          edit_message_id: int = None):
+    session = await load_session(chat_id)
+    prefix = session.words_prefix if session else None
+    rows, has_more, cursor_found = await run_db(get_user_words_page, user_id, cursor_id, backward, prefix)
+
+    if not rows:
+        if prefix:
+            text = f"🔎 Нет слов, начинающихся на «{prefix}»."
+            markup = words_page_markup(mode, rows, False, False, prefix)
+        else:
+            text = "У вас пока нет добавленных слов."
+            markup = main_menu()
+    else:
+        # Найденный курсор - граница соседней страницы, значит в обратную сторону слова точно есть
+        has_prev = has_more if backward else cursor_found
+        has_next = cursor_found if backward else has_more
+        title = "📚 Ваши слова" if mode == WORDS_VIEW else "Выберите слово для удаления"
+        if prefix:
+            title += f" на «{prefix}»"
+        text = f"{title}:"
+        if mode == WORDS_VIEW:
+            text += "\n" + "\n".join(f"{rus} - {eng}" for _, rus, eng in rows)
+        markup = words_page_markup(mode, rows, has_prev, has_next, prefix)
+
+    if edit_message_id:
+        try:
+            await api.edit_message_text(text, chat_id=chat_id, message_id=edit_message_id, reply_markup=markup)
+            return
+        except Exception as e:
+            log_error('edit_message_text', e, "Ошибка при редактировании сообщения")
+    await api.send_message(chat_id, text, reply_markup=markup)
+
+
+# Обработчик введённого перевода карточки
+@timed('step')
+async def process_typed_answer(message: types.Message):
+    chat_id = message.chat.id
+    session = await load_session(chat_id)
+    if not session or not session.correct_answer or not message.text:
+        return
+    user_id = await run_db(get_or_create_user, message.from_user)
     if not user_id:
-        bot.answer_callback_query(call.id, "Ошибка пользователя. Попробуйте снова.")
+        await api.send_message(chat_id, "❌ Ошибка пользователя", reply_markup=main_menu())
         return
 
-    try:
-        if call.data == 'start_quiz':
-            # Начало новой тренировки
-            previous_word = user_data.get(chat_id, {}).get('previous_word')
-            word_data = get_random_word_with_options(user_id, previous_word)
+    question = session.question
+    correct_answer = session.correct_answer
+    verdict, suggestions = await run_db(answer_dictionary.check, user_id, message.text, correct_answer)
+    correct = verdict != 'wrong'
+    latency_ms = int((time.time() - session.sent_at) * 1000) if session.sent_at else None
+    answer_log.log(user_id, session.word_id, question, correct, bool(session.failed), latency_ms)
+
+    # Интервальное повторение учитывает только первый ответ на карточку
+    if session.word_id and not session.failed:
+        await run_db(record_review, user_id, session.word_id, correct)
+
+    if correct:
+        response = f"✅ Отлично!\n{question} -> {correct_answer}"
+        if verdict == 'typo':
+            response = f"✅ Верно, но с опечаткой!\n{question} -> {correct_answer}"
+        session.clear_quiz()
+        await save_session(session)
+        await api.send_message(chat_id, response, reply_markup=next_typed_markup())
+        return
 
-            if not word_data:
-                bot.send_message(chat_id, "Не удалось получить слова для тренировки.", reply_markup=main_menu())
-                return
+    # Неправильный ответ - ждём следующую попытку
+    session.failed = True
+    session.input_step = TYPED_ANSWER_STEP
+    await save_session(session)
+    response = "❌ Неверно! Попробуйте ещё раз"
+    if suggestions:
+        response += "\n🤔 Похожие слова из словаря: " + ", ".join(suggestions)
+    await api.send_message(chat_id, response, reply_markup=typed_card_markup(session.card_token))
 
-            send_card(chat_id, word_data)
-            bot.answer_callback_query(call.id)
-            return
 
-        elif call.data.startswith('answer_'):
-            # Обработка ответа пользователя
-            data = user_data.get(chat_id)
-            if not data:
-                bot.answer_callback_query(call.id, "Ошибка: данные вопроса не найдены")
-                bot.send_message(chat_id, "⚠️ Сессия устарела. Начните новую тренировку.", reply_markup=main_menu())
-                return
+# Обработчик строки поиска по началу слова
+@timed('step')
+async def process_words_search(message: types.Message, mode: int):
+    chat_id = message.chat.id
+    user_id = await run_db(get_or_create_user, message.from_user)
+    if not user_id:
+        await api.send_message(chat_id, "❌ Ошибка пользователя", reply_markup=main_menu())
+        return
 
-            correct_answer = data.get('correct_answer')
-            question = data.get('question')
-            message_id = data.get('message_id')
-            other_words = data.get('other_words', [])
-            user_answer = call.data[len('answer_'):]
+    session = await load_session(chat_id, create=True)
+    session.words_prefix = message.text.strip() or None
+    await save_session(session)
+    await send_words_page(chat_id, user_id, mode)
 
-            if not correct_answer or not question:
-                bot.answer_callback_query(call.id, "Ошибка: данные вопроса не найдены")
-                bot.send_message(chat_id, "⚠️ Не удалось найти данные вопроса. Попробуйте начать заново.",
-                                 reply_markup=main_menu())
-                return
 
-            # Проверяем ответ
-            if user_answer == correct_answer:
-                response = f"✅ Отлично!\n{question} -> {correct_answer}"
-                bot.answer_callback_query(call.id, "✅ Верно!")
-
-                # Очищаем данные после правильного ответа, кроме previous_word
-                if chat_id in user_data:
-                    prev_word = user_data[chat_id].get('previous_word')
-                    user_data[chat_id] = {'previous_word': prev_word}
-
-                # Предлагаем продолжить
-                markup = types.InlineKeyboardMarkup()
-                markup.add(
-                    types.InlineKeyboardButton("➡️ Следующее слово", callback_data="start_quiz"),
-                    types.InlineKeyboardButton("🏠 В главное меню", callback_data="main_menu")
-                )
+IMPORT_HELP = """
+📥 Импорт слов из файла
 
-                # Пытаемся отредактировать сообщение или отправить новое
-                try:
-                    if message_id:
-                        bot.edit_message_text(
-                            response,
-                            chat_id=chat_id,
-                            message_id=message_id,
-                            reply_markup=markup
-                        )
-                    else:
-                        bot.send_message(chat_id, response, reply_markup=markup)
-                except Exception as e:
-                    print(f"Ошибка при редактировании сообщения: {e}")
-                    bot.send_message(chat_id, response, reply_markup=markup)
-            else:
-                # Неправильный ответ - показываем тот же вопрос снова
-                bot.answer_callback_query(call.id, "❌ Неверно! Попробуйте еще раз")
-
-                # Создаем новые данные для вопроса (можно оставить те же варианты)
-                word_data = {
-                    'word': question,
-                    'translation': correct_answer,
-                    'other_words': other_words
-                }
-
-                # Редактируем сообщение с тем же вопросом
-                send_card(chat_id, word_data, message_id)
+Отправьте боту файл .csv или .tsv (UTF-8), по одной паре на строку:
+слово,перевод
+
+Разделитель - запятая, точка с запятой или табуляция. Первая строка с заголовком word,translation
+(или слово,перевод) пропускается, лишние столбцы не учитываются, поэтому файл из /export
+можно загрузить обратно. Уже добавленные слова получат перевод из файла.
+"""
+
+
+# Обработчик команды /import
+async def send_import_help(message: types.Message):
+    await api.send_message(message.chat.id, IMPORT_HELP, reply_markup=main_menu())
+
+
+# Обработчик команды /export [csv|json]: файл со всеми словами пользователя
+async def send_export(message: types.Message):
+    chat_id = message.chat.id
+    try:
+        args = message.text.split()[1:]
+        export_format = args[0].lower() if args else 'csv'
+        if export_format not in EXPORT_FORMATS:
+            await api.send_message(chat_id, "❌ Формат выгрузки: /export csv или /export json",
+                                   reply_markup=main_menu())
+            return
+
+        user_id = await run_db(get_or_create_user, message.from_user)
+        if not user_id:
+            await api.send_message(chat_id, "❌ Ошибка пользователя", reply_markup=main_menu())
             return
 
-        elif call.data == 'add_word':
-            # Начало процесса добавления слова - запрашиваем русское слово
-            ask_for_russian_word(chat_id)
+        result = await run_db(export_user_words, user_id, export_format)
+        if result is None:
+            await api.send_message(chat_id, "❌ Не удалось выгрузить слова", reply_markup=main_menu())
             return
 
-        elif call.data == 'delete_word':
-            # Удаление слова - показ списка
-            user_words = get_user_words(user_id)
-            if not user_words:
-                bot.send_message(chat_id, "У вас пока нет добавленных слов.", reply_markup=main_menu())
+        out, count = result
+        with out:
+            if not count:
+                await api.send_message(chat_id, "📭 У вас пока нет добавленных слов", reply_markup=main_menu())
                 return
+            await api.send_document(chat_id, out, visible_file_name=f"words.{export_format}",
+                                    caption=f"📤 Ваши слова: {count}", reply_markup=main_menu())
+    except Exception as e:
+        log_error('send_export', e)
+        await api.send_message(chat_id, "⚠️ Произошла ошибка. Попробуйте позже.")
+
 
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            for word, _ in user_words:
-                markup.add(types.InlineKeyboardButton(word, callback_data=f"ask_del_{word}"))
-            markup.add(types.InlineKeyboardButton("🔙 Назад", callback_data="main_menu"))
-            bot.send_message(chat_id, "Выберите слово для удаления:", reply_markup=markup)
+# Обработчик загруженного файла: импорт слов
+async def handle_document(message: types.Message):
+    chat_id = message.chat.id
+    document = message.document
+    try:
+        user_id = await run_db(get_or_create_user, message.from_user)
+        if not user_id:
+            await api.send_message(chat_id, "❌ Ошибка пользователя", reply_markup=main_menu())
+            return
+        if document.file_size and document.file_size > IMPORT_MAX_BYTES:
+            await api.send_message(chat_id, f"❌ Файл слишком большой (максимум {IMPORT_MAX_BYTES // 1024} КБ)",
+                                   reply_markup=main_menu())
             return
 
-        elif call.data.startswith('ask_del_'):
-            # Подтверждение удаления
-            word = call.data[len('ask_del_'):]
-            bot.send_message(
-                chat_id,
-                f"Вы уверены, что хотите удалить слово '{word}'?",
-                reply_markup=confirm_delete_markup(word)
-            )
+        file_info = await api.get_file(document.file_id)
+        data = await api.download_file(file_info.file_path)
+        report = await run_db(import_user_words, user_id, data)
+        if report is None:
+            await api.send_message(chat_id, "❌ Не удалось импортировать слова", reply_markup=main_menu())
             return
 
-        elif call.data.startswith('confirm_del_'):
-            # Подтвержденное удаление
-            word = call.data[len('confirm_del_'):]
-            if delete_user_word(user_id, word):
-                bot.answer_callback_query(call.id, f"✅ Слово '{word}' удалено")
-                bot.send_message(chat_id, f"✅ Слово '{word}' успешно удалено!", reply_markup=main_menu())
+        text = (
+            f"📥 Импорт завершён\n"
+            f"➕ Добавлено: {report['inserted']}\n"
+            f"✏️ Обновлено: {report['updated']}\n"
+            f"➖ Без изменений: {report['unchanged']}\n"
+            f"🔁 Повторы в файле: {report['duplicates']}\n"
+            f"❌ Отклонено: {report['rejected']}"
+        )
+        if report['rejected_lines']:
+            text += f" (строки: {', '.join(map(str, report['rejected_lines']))})"
+        if report['truncated']:
+            text += f"\n⚠️ Загружены только первые {IMPORT_MAX_ROWS} строк"
+        await api.send_message(chat_id, text, reply_markup=main_menu())
+    except Exception as e:
+        log_error('handle_document', e)
+        await api.send_message(chat_id, "⚠️ Произошла ошибка. Попробуйте позже.")
+
+
+# Обработчики inline-кнопок по кодам операций: call, user_id и аргументы из callback_data
+CALLBACK_HANDLERS: Dict[str, Callable[..., Awaitable]] = {}
+
+
+def callback_handler(opcode: str):
+    def register(handler):
+        CALLBACK_HANDLERS[opcode] = timed('callback')(handler)
+        return handler
+    return register
+
+
+# Начало новой тренировки
+@callback_handler(OP_START_QUIZ)
+async def on_start_quiz(call: types.CallbackQuery, user_id: int):
+    chat_id = call.message.chat.id
+    session = await load_session(chat_id)
+    previous_word = session.previous_word if session else None
+    word_data = await run_db(card_queue.next_card, user_id, previous_word)
+
+    if not word_data:
+        await api.send_message(chat_id, "Не удалось получить слова для тренировки.", reply_markup=main_menu())
+        return
+
+    await send_card(chat_id, word_data)
+    await api.answer_callback_query(call.id)
+
+
+# Обработка ответа пользователя
+@callback_handler(OP_ANSWER)
+async def on_answer(call: types.CallbackQuery, user_id: int, card_token: int, option_index: int):
+    chat_id = call.message.chat.id
+    session = await load_session(chat_id)
+    if not session:
+        await api.answer_callback_query(call.id, "Ошибка: данные вопроса не найдены")
+        await api.send_message(chat_id, "⚠️ Сессия устарела. Начните новую тренировку.", reply_markup=main_menu())
+        return
+
+    correct_answer = session.correct_answer
+    question = session.question
+    message_id = session.message_id
+    other_words = session.other_words or []
+
+    if not correct_answer or not question or session.card_token != card_token:
+        await api.answer_callback_query(call.id, "Ошибка: данные вопроса не найдены")
+        await api.send_message(chat_id, "⚠️ Не удалось найти данные вопроса. Попробуйте начать заново.",
+                               reply_markup=main_menu())
+        return
+
+    correct = option_index == session.correct_index
+    latency_ms = int((time.time() - session.sent_at) * 1000) if session.sent_at else None
+    answer_log.log(user_id, session.word_id, question, correct, bool(session.failed), latency_ms)
+
+    # Интервальное повторение учитывает только первый ответ на карточку
+    if session.word_id and not session.failed:
+        await run_db(record_review, user_id, session.word_id, correct)
+
+    # Проверяем ответ
+    if correct:
+        response = f"✅ Отлично!\n{question} -> {correct_answer}"
+        await api.answer_callback_query(call.id, "✅ Верно!")
+
+        # Очищаем данные после правильного ответа, кроме previous_word
+        session.clear_quiz()
+        await save_session(session)
+
+        # Предлагаем продолжить
+        markup = next_card_markup()
+
+        # Пытаемся отредактировать сообщение или отправить новое
+        try:
+            if message_id:
+                await api.edit_message_text(
+                    response,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    reply_markup=markup
+                )
             else:
-                bot.answer_callback_query(call.id, f"❌ Не удалось удалить слово '{word}'")
-                bot.send_message(chat_id, f"❌ Не удалось удалить слово '{word}'", reply_markup=main_menu())
-            return
+                await api.send_message(chat_id, response, reply_markup=markup)
+        except Exception as e:
+            log_error('edit_message_text', e, "Ошибка при редактировании сообщения")
+            await api.send_message(chat_id, response, reply_markup=markup)
+    else:
+        # Неправильный ответ - показываем тот же вопрос снова
+        await api.answer_callback_query(call.id, "❌ Неверно! Попробуйте еще раз")
 
-        elif call.data == 'cancel_delete':
-            # Отмена удаления - возвращаемся в главное меню
-            bot.answer_callback_query(call.id, "❌ Удаление отменено")
-            bot.send_message(chat_id, "Главное меню:", reply_markup=main_menu())
-            return
+        # Создаем новые данные для вопроса (можно оставить те же варианты)
+        word_data = {
+            'id': session.word_id,
+            'word': question,
+            'translation': correct_answer,
+            'other_words': other_words,
+            'failed': True
+        }
+
+        # Редактируем сообщение с тем же вопросом
+        await send_card(chat_id, word_data, message_id)
+
+
+# Тренировка с вводом перевода
+@callback_handler(OP_TYPED_QUIZ)
+async def on_typed_quiz(call: types.CallbackQuery, user_id: int):
+    chat_id = call.message.chat.id
+    session = await load_session(chat_id)
+    previous_word = session.previous_word if session else None
+    word_data = await run_db(card_queue.next_card, user_id, previous_word)
+
+    if not word_data:
+        await api.send_message(chat_id, "Не удалось получить слова для тренировки.", reply_markup=main_menu())
+        return
+
+    await send_typed_card(chat_id, word_data)
+    await api.answer_callback_query(call.id)
+
+
+# Показ ответа в тренировке с вводом - засчитывается как ошибка
+@callback_handler(OP_TYPED_REVEAL)
+async def on_typed_reveal(call: types.CallbackQuery, user_id: int, card_token: int):
+    chat_id = call.message.chat.id
+    session = await load_session(chat_id)
+    if not session or not session.correct_answer or session.card_token != card_token:
+        await api.answer_callback_query(call.id, "Ошибка: данные вопроса не найдены")
+        return
+
+    question = session.question
+    correct_answer = session.correct_answer
+    latency_ms = int((time.time() - session.sent_at) * 1000) if session.sent_at else None
+    answer_log.log(user_id, session.word_id, question, False, bool(session.failed), latency_ms)
+    if session.word_id and not session.failed:
+        await run_db(record_review, user_id, session.word_id, False)
+
+    session.clear_quiz()
+    session.input_step = None
+    await save_session(session)
+    await api.answer_callback_query(call.id)
+    await api.send_message(chat_id, f"💡 {question} -> {correct_answer}", reply_markup=next_typed_markup())
+
+
+# Начало процесса добавления слова - запрашиваем русское слово
+@callback_handler(OP_ADD_WORD)
+async def on_add_word(call: types.CallbackQuery, user_id: int):
+    await ask_for_russian_word(call.message.chat.id)
+
+
+# Удаление слова - показ первой страницы списка
+@callback_handler(OP_DELETE_WORD)
+async def on_delete_word(call: types.CallbackQuery, user_id: int):
+    await send_words_page(call.message.chat.id, user_id, WORDS_DELETE)
+
+
+# Подтверждение удаления
+@callback_handler(OP_ASK_DELETE)
+async def on_ask_delete(call: types.CallbackQuery, user_id: int, word_id: int):
+    chat_id = call.message.chat.id
+    user_word = await run_db(get_user_word, user_id, word_id)
+    if not user_word:
+        await api.answer_callback_query(call.id, "❌ Слово не найдено")
+        return
+    await api.send_message(
+        chat_id,
+        f"Вы уверены, что хотите удалить слово '{user_word[0]}'?",
+        reply_markup=confirm_delete_markup(word_id)
+    )
+
+
+# Подтвержденное удаление
+@callback_handler(OP_CONFIRM_DELETE)
+async def on_confirm_delete(call: types.CallbackQuery, user_id: int, word_id: int):
+    chat_id = call.message.chat.id
+    word = await run_db(delete_user_word, user_id, word_id)
+    if word:
+        await api.answer_callback_query(call.id, f"✅ Слово '{word}' удалено")
+        await api.send_message(chat_id, f"✅ Слово '{word}' успешно удалено!", reply_markup=main_menu())
+    else:
+        await api.answer_callback_query(call.id, "❌ Не удалось удалить слово")
+        await api.send_message(chat_id, "❌ Не удалось удалить слово", reply_markup=main_menu())
+
+
+# Отмена удаления - возвращаемся в главное меню
+@callback_handler(OP_CANCEL_DELETE)
+async def on_cancel_delete(call: types.CallbackQuery, user_id: int):
+    await api.answer_callback_query(call.id, "❌ Удаление отменено")
+    await api.send_message(call.message.chat.id, "Главное меню:", reply_markup=main_menu())
+
+
+# Показ первой страницы списка слов пользователя
+@callback_handler(OP_MY_WORDS)
+async def on_my_words(call: types.CallbackQuery, user_id: int):
+    await send_words_page(call.message.chat.id, user_id, WORDS_VIEW)
+
+
+# Переход на соседнюю страницу списка (редактируем то же сообщение)
+@callback_handler(OP_WORDS_PAGE)
+async def on_words_page(call: types.CallbackQuery, user_id: int, mode: int, backward: int, cursor_id: int):
+    await send_words_page(call.message.chat.id, user_id, mode, cursor_id, bool(backward),
+                          edit_message_id=call.message.message_id)
+    await api.answer_callback_query(call.id)
+
+
+# Запрос строки поиска по началу слова
+@callback_handler(OP_WORDS_SEARCH)
+async def on_words_search(call: types.CallbackQuery, user_id: int, mode: int):
+    chat_id = call.message.chat.id
+    session = await load_session(chat_id, create=True)
+    session.input_step = WORDS_SEARCH_STEPS[mode]
+    await save_session(session)
+    await api.answer_callback_query(call.id)
+    await api.send_message(chat_id, "🔎 Введите начало слова:", reply_markup=types.ForceReply())
+
+
+# Сброс поиска - снова весь список
+@callback_handler(OP_WORDS_RESET)
+async def on_words_reset(call: types.CallbackQuery, user_id: int, mode: int):
+    chat_id = call.message.chat.id
+    session = await load_session(chat_id)
+    if session and session.words_prefix:
+        session.words_prefix = None
+        await save_session(session)
+    await send_words_page(chat_id, user_id, mode, edit_message_id=call.message.message_id)
+    await api.answer_callback_query(call.id)
+
+
+# Возврат в главное меню
+@callback_handler(OP_MAIN_MENU)
+async def on_main_menu(call: types.CallbackQuery, user_id: int):
+    await api.send_message(call.message.chat.id, "Главное меню:", reply_markup=main_menu())
+
+
+# Статистика пользователя из счётчиков user_stats
+@callback_handler(OP_STATS)
+async def on_stats(call: types.CallbackQuery, user_id: int):
+    chat_id = call.message.chat.id
+    counters = await run_db(get_user_stats, user_id)
+    if not counters:
+        await api.answer_callback_query(call.id, "❌ Не удалось получить статистику")
+        return
+
+    answers = counters['answers']
+    accuracy = round(counters['correct_answers'] * 100 / answers) if answers else 0
+    await api.answer_callback_query(call.id)
+    await api.send_message(
+        chat_id,
+        f"📊 Ваша статистика\n\n"
+        f"📚 Слов в словаре: {counters['words_count']}\n"
+        f"✍️ Ответов: {answers}\n"
+        f"✅ Верно с первой попытки: {counters['correct_answers']} ({accuracy}%)\n"
+        f"🔥 Серия верных ответов: {counters['streak']} (рекорд: {counters['best_streak']})",
+        reply_markup=main_menu()
+    )
+
+
+# Кнопка из старого сообщения или неизвестного формата
+@callback_handler(OP_STALE)
+async def on_stale_button(call: types.CallbackQuery, user_id: int):
+    await api.answer_callback_query(call.id, "⚠️ Кнопка устарела")
+    await api.send_message(call.message.chat.id, "Главное меню:", reply_markup=main_menu())
 
-        elif call.data == 'my_words':
-            # Показ списка слов пользователя
-            user_words = get_user_words(user_id)
 
-            if not user_words:
-                bot.send_message(chat_id, "У вас пока нет добавленных слов.", reply_markup=main_menu())
+# Обработчик inline-кнопок: выбор обработчика по коду операции из таблицы
+async def handle_callback_query(call: types.CallbackQuery):
+    user = call.from_user
+    user_id = await run_db(get_or_create_user, user)
+
+    if not user_id:
+        await api.answer_callback_query(call.id, "Ошибка пользователя. Попробуйте снова.")
+        return
+
+    try:
+        opcode, args = decode_callback(call.data or '')
+        handler = CALLBACK_HANDLERS.get(opcode, CALLBACK_HANDLERS[OP_STALE])
+        await handler(call, user_id, *args)
+    except Exception as e:
+        log_error('handle_callback_query', e, "Ошибка в обработке callback", trace=True)
+        await api.answer_callback_query(call.id, "⚠️ Произошла ошибка. Попробуйте снова.")
+
+
+# Окно, в котором повторное нажатие той же кнопки считается дублем, сек
+CALLBACK_DEDUP_WINDOW = float(os.getenv("CALLBACK_DEDUP_WINDOW", "1.0"))
+CALLBACK_DEDUP_MAX = 10000  # сколько последних нажатий помнить
+
+
+# Последовательная обработка обновлений одного чата: разные чаты обрабатываются параллельно,
+# а обновления одного чата - строго в порядке поступления и не гоняются за общую сессию.
+# Порядок задаётся номером в очереди чата (ticket), который берётся там, где обновления ещё идут
+# по порядку (поток polling, приём webhook, цикл воркера); hold пропускает номера по возрастанию
+class ChatSerializer:
+    def __init__(self, dedup_window: float = CALLBACK_DEDUP_WINDOW):
+        self.dedup_window = dedup_window
+        self._guard = threading.Lock()
+        # chat_id -> задачи чата, ждущие окончания выполняющейся, с функциями их запуска;
+        # запись есть, пока у чата выполняется задача
+        self._chats: Dict[int, deque] = {}
+        # Для режима async: все обработчики выполняются в одном event loop
+        self._async_locks: Dict[int, list] = {}
+        self._recent_callbacks: "OrderedDict[Tuple[int, int, str], float]" = OrderedDict()
+        self.stats = {'waits': 0, 'duplicates': 0}
+
+    # Выполнение задачи в очереди чата. Если у чата ничего не выполняется, task сразу передаётся в submit
+    # (пул потоков), иначе ждёт в очереди чата и передаётся в submit, когда закончится предыдущая.
+    # Поток пула не ждёт очереди своего чата, поэтому занятый чат не задерживает остальные
+    def dispatch(self, chat_id: int, submit: Callable, task: Callable):
+        def run():
+            try:
+                task()
+            finally:
+                with self._guard:
+                    pending = self._chats[chat_id]
+                    if pending:
+                        next_submit, next_run = pending.popleft()
+                    else:
+                        del self._chats[chat_id]
+                        next_run = None
+                if next_run is not None:
+                    next_submit(next_run)
+
+        with self._guard:
+            pending = self._chats.get(chat_id)
+            if pending is not None:
+                pending.append((submit, run))
+                self.stats['waits'] += 1
                 return
+            self._chats[chat_id] = deque()
+        submit(run)
+
+    @asynccontextmanager
+    async def hold_async(self, chat_id: int):
+        entry = self._async_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        if entry[0].locked():
+            self.stats['waits'] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._async_locks[chat_id]
+
+    # Повторное нажатие той же кнопки того же сообщения (например, двойной тап)
+    def is_duplicate(self, call: types.CallbackQuery) -> bool:
+        message_id = call.message.message_id if call.message else call.inline_message_id
+        key = (update_chat_id(call), message_id, call.data)
+        now = time.monotonic()
+        with self._guard:
+            pressed_at = self._recent_callbacks.get(key)
+            self._recent_callbacks[key] = now
+            self._recent_callbacks.move_to_end(key)
+            while len(self._recent_callbacks) > CALLBACK_DEDUP_MAX:
+                self._recent_callbacks.popitem(last=False)
+            if pressed_at is not None and now - pressed_at < self.dedup_window:
+                self.stats['duplicates'] += 1
+                return True
+            return False
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._guard:
+            stats = dict(self.stats)
+            stats['active_chats'] = len(self._chats) + len(self._async_locks)
+        return stats
+
+
+chat_serializer = ChatSerializer()
+
+
+# Чат, к которому относится сообщение или нажатие кнопки
+def update_chat_id(update_object) -> int:
+    if isinstance(update_object, types.CallbackQuery):
+        # Кнопка inline-сообщения приходит без message - очередь пользователя, как в raw_update_chat_id
+        return update_object.message.chat.id if update_object.message else update_object.from_user.id
+    return update_object.chat.id
+
+
+# Обёртка корутины-обработчика для потоков синхронного TeleBot.
+# Очередь чата соблюдается раньше, при передаче обновления в поток (ChatOrderedTeleBot, process_update)
+def sync_handler(handler):
+    handler = timed('handler')(handler)
+
+    @functools.wraps(handler)
+    def wrapper(update_object):
+        if isinstance(update_object, types.CallbackQuery) and chat_serializer.is_duplicate(update_object):
+            return run_sync(api.answer_callback_query(update_object.id))
+        return run_sync(handler(update_object))
+    return wrapper
+
+
+# Обёртка корутины-обработчика для AsyncTeleBot
+def async_handler(handler):
+    handler = timed('handler')(handler)
+
+    @functools.wraps(handler)
+    async def wrapper(update_object):
+        if isinstance(update_object, types.CallbackQuery) and chat_serializer.is_duplicate(update_object):
+            return await api.answer_callback_query(update_object.id)
+        async with chat_serializer.hold_async(update_chat_id(update_object)):
+            return await handler(update_object)
+    return wrapper
+
+
+# Регистрация обработчиков в выбранном режиме
+if BOT_MODE == 'async':
+    api.message_handler(commands=["start", "help"])(async_handler(send_welcome))
+    api.message_handler(commands=["import"])(async_handler(send_import_help))
+    api.message_handler(commands=["export"])(async_handler(send_export))
+    api.message_handler(content_types=['document'])(async_handler(handle_document))
+    api.message_handler(content_types=['text'])(async_handler(handle_text_message))
+    api.callback_query_handler(func=lambda call: True)(async_handler(handle_callback_query))
+else:
+    bot.message_handler(commands=["start", "help"])(sync_handler(send_welcome))
+    bot.message_handler(commands=["import"])(sync_handler(send_import_help))
+    bot.message_handler(commands=["export"])(sync_handler(send_export))
+    bot.message_handler(content_types=['document'])(sync_handler(handle_document))
+    bot.message_handler(content_types=['text'])(sync_handler(handle_text_message))
+    bot.callback_query_handler(func=lambda call: True)(sync_handler(handle_callback_query))
+
+
+# Запуск long polling в режиме asyncio
+async def run_async_polling():
+    try:
+        await api.infinity_polling()
+    finally:
+        await close_api_session()
+
+
+# Параметры приёма обновлений
+BOT_UPDATES = os.getenv("BOT_UPDATES", "polling")  # polling или webhook
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # внешний адрес; если задан, webhook регистрируется в Telegram
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+
+# Event loop бота в режиме async (нужен потокам, которые передают ему обновления)
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+# Чат обновления по его JSON (без разбора в объекты telebot); 0 - обновление без чата
+def raw_update_chat_id(update: Dict) -> int:
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                'my_chat_member', 'chat_member', 'chat_join_request'):
+        if key in update:
+            return update[key]['chat']['id']
+    if 'callback_query' in update:
+        call = update['callback_query']
+        return call['message']['chat']['id'] if call.get('message') else call['from']['id']
+    for value in update.values():
+        if isinstance(value, dict) and 'from' in value:
+            return value['from']['id']
+    return 0
+
+
+# Чат обновления по телу запроса; 0 - если тело не разбирается (ошибку покажет обработка обновления)
+def body_chat_id(body) -> int:
+    try:
+        return raw_update_chat_id(json.loads(body))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return 0
 
-            words_count = len(user_words)
-            words_list = "\n".join([f"{rus} - {eng}" for rus, eng in user_words])
-            bot.send_message(
-                chat_id,
-                f"📚 Ваши слова ({words_count}):\n{words_list}",
-                reply_markup=main_menu()
-            )
-            return
 
-        elif call.data == 'main_menu':
-            # Возврат в главное меню
-            bot.send_message(chat_id, "Главное меню:", reply_markup=main_menu())
+# Обработка одного обновления в текущем режиме бота
+def process_update(update: types.Update):
+    if BOT_MODE == 'async':
+        asyncio.run_coroutine_threadsafe(api.process_new_updates([update]), _async_loop).result()
+    else:
+        bot.process_new_updates([update])
+
+
+# HTTP-обработчик webhook: только кладёт обновление в очередь, обработка - в воркерах
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    server: "WebhookServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, code: int, body: bytes = b"", headers: Dict[str, str] = None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == WEBHOOK_PATH + "/stats":
+            self._reply(200, json.dumps(self.server.snapshot()).encode(), {"Content-Type": "application/json"})
+        else:
+            self._reply(404)
+
+    def do_POST(self):
+        if self.path != WEBHOOK_PATH:
+            self._reply(404)
             return
+        if WEBHOOK_SECRET and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            self._reply(403)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.enqueue(body):
+            self._reply(200)
+        else:
+            # Очередь заполнена - Telegram повторит доставку позже
+            self._reply(429, headers={"Retry-After": "1"})
+
+
+# Сервер webhook с ограниченной очередью и пулом воркеров
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address: Tuple[str, int], queue_size: int = WEBHOOK_QUEUE_SIZE,
+                 workers: int = WEBHOOK_WORKERS):
+        super().__init__(address, WebhookRequestHandler)
+        self.queue_size = queue_size
+        # Задачи, готовые к выполнению; обновления занятого чата ждут в его очереди в chat_serializer
+        self.updates = queue.Queue()
+        self._workers = [threading.Thread(target=self._work, name=f"webhook-worker-{i}", daemon=True)
+                         for i in range(workers)]
+        self._lock = threading.Lock()
+        # Принятые и ещё не обработанные обновления - и готовые, и ждущие очереди своего чата
+        self._backlog = 0
+        self._drained = threading.Condition(self._lock)
+        self.stats = {
+            'received': 0,
+            'handled': 0,
+            'dropped': 0,
+            'errors': 0,
+            'latency_total_ms': 0.0,
+            'latency_max_ms': 0.0,
+        }
+
+    # Обновление ставится в очередь своего чата при приёме, поэтому воркеры
+    # обрабатывают обновления одного чата в порядке приёма
+    def enqueue(self, body: bytes) -> bool:
+        chat_id = body_chat_id(body)
+        with self._lock:
+            if self._backlog >= self.queue_size:
+                self.stats['dropped'] += 1
+                return False
+            self._backlog += 1
+            self.stats['received'] += 1
+        chat_serializer.dispatch(chat_id, self.updates.put, functools.partial(self._handle, time.monotonic(), body))
+        return True
+
+    def _handle(self, enqueued_at: float, body: bytes):
+        latency_ms = (time.monotonic() - enqueued_at) * 1000
+        try:
+            process_update(types.Update.de_json(body.decode("utf-8")))
+            error = False
+        except Exception as e:
+            log_error('process_update', e, "Ошибка обработки обновления из webhook")
+            error = True
+        with self._lock:
+            self._backlog -= 1
+            if not self._backlog:
+                self._drained.notify_all()
+            self.stats['handled'] += 1
+            self.stats['errors'] += error
+            self.stats['latency_total_ms'] += latency_ms
+            self.stats['latency_max_ms'] = max(self.stats['latency_max_ms'], latency_ms)
+
+    def _work(self):
+        while True:
+            task = self.updates.get()
+            if task is None:
+                break
+            task()
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        threading.Thread(target=self.serve_forever, name="webhook-server", daemon=True).start()
+
+    def stop(self):
+        # Перестаём принимать запросы и дорабатываем то, что уже в очереди, - в том числе
+        # обновления, которые ждут очереди своего чата и попадут в self.updates позже
+        self.shutdown()
+        with self._lock:
+            while self._backlog:
+                self._drained.wait()
+        for _ in self._workers:
+            self.updates.put(None)
+        for worker in self._workers:
+            worker.join()
+        self.server_close()
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['queue_depth'] = self._backlog
+        stats['queue_size'] = self.queue_size
+        stats['latency_avg_ms'] = round(stats['latency_total_ms'] / stats['handled'], 3) if stats['handled'] else 0.0
+        return stats
+
+
+# Запуск бота в режиме webhook
+def run_webhook():
+    global _async_loop
+    server = WebhookServer((WEBHOOK_LISTEN, WEBHOOK_PORT))
+    METRICS_SOURCES['webhook'] = server.snapshot
+    if BOT_MODE == 'async':
+        # Цикл событий в своём потоке: при остановке воркеры webhook дорабатывают очередь через него
+        _async_loop = asyncio.new_event_loop()
+        threading.Thread(target=_async_loop.run_forever, name="bot-loop", daemon=True).start()
+    else:
+        # Обработчики выполняют воркеры webhook, собственный пул потоков telebot не нужен
+        bot.threaded = False
+    if WEBHOOK_URL:
+        bot.remove_webhook()
+        bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    server.start()
+    print(f"🌐 Webhook слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        if _async_loop is not None:
+            asyncio.run_coroutine_threadsafe(close_api_session(), _async_loop).result()
+            _async_loop.call_soon_threadsafe(_async_loop.stop)
+
+
+# Несколько процессов: супервизор принимает обновления и раздаёт их воркерам по чатам
+BOT_PROCESSES = int(os.getenv("BOT_PROCESSES", "1"))  # больше 1 - режим супервизора
+BOT_WORKER_THREADS = int(os.getenv("BOT_WORKER_THREADS", "8"))  # обработчиков одновременно в одном воркере
+BOT_DRAIN_TIMEOUT = float(os.getenv("BOT_DRAIN_TIMEOUT", "30"))  # ожидание доработки очереди воркером, сек
+BOT_POLL_TIMEOUT = 20  # long polling супервизора, сек
+WORKER_STATS_INTERVAL = 5  # как часто воркер отправляет супервизору счётчики, сек
+
+
+# Номер воркера для чата: стабильный хеш, чтобы чат всегда попадал в один и тот же процесс
+def chat_shard(chat_id: int, shards: int) -> int:
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+
+# Процесс-воркер: обрабатывает обновления своей доли чатов, пока не получит None.
+# Сессии, кэши и очередь отправки у каждого воркера свои, общая у всех только БД
+def run_worker(index: int, updates, control, send_rate: float = SEND_GLOBAL_RATE,
+               threads: int = BOT_WORKER_THREADS):
+    global _async_loop
+    # Ctrl+C получает вся группа процессов - остановкой воркеров управляет супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # SIGTERM воркеру - просьба к супервизору перезапустить его, доработав очередь
+    signal.signal(signal.SIGTERM, lambda signum, frame: control.put(('drain', index)))
+    outbound.set_global_rate(send_rate)
+    parent_pid = os.getppid()
+    stats = {'handled': 0, 'errors': 0}
+    stats_lock = threading.Lock()
+    slots = threading.BoundedSemaphore(threads)
+
+    # Счётчики отправляются приращениями: после падения воркера теряется не больше интервала
+    def report_stats():
+        nonlocal stats
+        with stats_lock:
+            delta, stats = stats, {'handled': 0, 'errors': 0}
+        control.put(('stats', index, delta))
+
+    def handle(body: str):
+        try:
+            process_update(types.Update.de_json(body))
+            error = False
+        except Exception as e:
+            log_error('process_update', e, f"Ошибка обработки обновления в воркере {index}")
+            error = True
+        finally:
+            slots.release()
+        with stats_lock:
+            stats['handled'] += 1
+            stats['errors'] += error
+
+    if BOT_MODE == 'async':
+        _async_loop = asyncio.new_event_loop()
+        threading.Thread(target=_async_loop.run_forever, name="bot-loop", daemon=True).start()
+    else:
+        bot.threaded = False
+    try:
+        base_words_cache.refresh(force=True)
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT + 1 + index)
+        control.put(('ready', index))
+        reported_at = time.monotonic()
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"worker-{index}") as executor:
+            while True:
+                if time.monotonic() - reported_at >= WORKER_STATS_INTERVAL:
+                    report_stats()
+                    reported_at = time.monotonic()
+                try:
+                    body = updates.get(timeout=1)
+                except queue.Empty:
+                    if os.getppid() != parent_pid:
+                        # Супервизор завершился аварийно - новых обновлений не будет
+                        break
+                    continue
+                if body is None:
+                    break
+                # Очередь чата ведётся здесь, пока обновления идут по порядку, а не в потоках пула
+                slots.acquire()
+                chat_serializer.dispatch(body_chat_id(body), executor.submit, functools.partial(handle, body))
+            # Дожидаемся и обновлений, ждущих очереди своего чата: после выхода из with пул их не примет
+            for _ in range(threads):
+                slots.acquire()
+    finally:
+        card_queue.shutdown()
+        outbound.shutdown()
+        answer_log.shutdown()
+        close_db_pool()
+        if _async_loop is not None:
+            asyncio.run_coroutine_threadsafe(close_api_session(), _async_loop).result()
+            _async_loop.call_soon_threadsafe(_async_loop.stop)
+        report_stats()
+
+
+# Супервизор: запускает BOT_PROCESSES воркеров, направляет обновления по chat_shard
+# и перезапускает воркеры - упавшие сразу, остальные по запросу с дорабатыванием очереди
+class Supervisor:
+    def __init__(self, processes: int = BOT_PROCESSES):
+        self.processes = processes
+        # spawn, а не fork: у родителя уже есть потоки и соединения с БД
+        self._context = multiprocessing.get_context("spawn")
+        self.control = self._context.Queue()
+        self._queues = [None] * processes
+        self._workers = [None] * processes
+        # Обновления чатов перезапускаемого воркера ждут здесь нового процесса
+        self._buffers: Dict[int, deque] = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._monitor = threading.Thread(target=self._watch, name="supervisor", daemon=True)
+        self._replacers: Dict[int, threading.Thread] = {}  # потоки, ждущие доработки воркеров
+        self.stats = {
+            'started': 0,  # воркеров запущено и готово к работе, с учётом перезапусков
+            'routed': 0,
+            'buffered': 0,
+            'restarts': 0,
+            'crashes': 0,
+            'handled': 0,
+            'errors': 0,
+        }
+
+    def _spawn(self, index: int):
+        updates = self._context.Queue()
+        # Общий лимит отправки делится между воркерами, лимиты чатов остаются прежними - чаты не пересекаются
+        worker = self._context.Process(target=run_worker,
+                                       args=(index, updates, self.control, SEND_GLOBAL_RATE / self.processes),
+                                       name=f"bot-worker-{index}")
+        worker.start()
+        return updates, worker
+
+    def start(self) -> "Supervisor":
+        for index in range(self.processes):
+            self._queues[index], self._workers[index] = self._spawn(index)
+        self._monitor.start()
+        return self
+
+    def route(self, update: Dict, body: str = None):
+        index = chat_shard(raw_update_chat_id(update), self.processes)
+        body = body or json.dumps(update, ensure_ascii=False)
+        with self._lock:
+            self.stats['routed'] += 1
+            buffer = self._buffers.get(index)
+            if buffer is not None:
+                buffer.append(body)
+                self.stats['buffered'] += 1
+            else:
+                self._queues[index].put(body)
+
+    # Плавный перезапуск: воркер дорабатывает свою очередь и завершается, новые обновления
+    # его чатов копятся в буфере и передаются новому процессу. Доработку ждёт отдельный поток,
+    # чтобы монитор тем временем обслуживал остальных воркеров
+    def restart(self, index: int) -> Optional[threading.Thread]:
+        with self._lock:
+            if self._stopping:
+                return None
+            if index in self._buffers:
+                return self._replacers[index]
+            self._buffers[index] = deque()
+            thread = threading.Thread(target=self._replace, args=(index,), name=f"supervisor-restart-{index}",
+                                      daemon=True)
+            self._replacers[index] = thread
+            thread.start()
+        return thread
+
+    def _replace(self, index: int):
+        with self._lock:
+            updates, worker = self._queues[index], self._workers[index]
+        if worker.is_alive():
+            updates.put(None)
+            worker.join(BOT_DRAIN_TIMEOUT)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+                updates.cancel_join_thread()
+        else:
+            with self._lock:
+                self.stats['crashes'] += 1
+        # Что осталось в очереди (после падения воркера), передаём новому процессу
+        leftover = []
+        while True:
+            try:
+                body = updates.get(timeout=0.1)
+            except queue.Empty:
+                break
+            if body is not None:
+                leftover.append(body)
+        updates.close()
+
+        new_updates, new_worker = self._spawn(index)
+        with self._lock:
+            for body in leftover + list(self._buffers.pop(index)):
+                new_updates.put(body)
+            self._queues[index], self._workers[index] = new_updates, new_worker
+            self.stats['restarts'] += 1
+
+    # Поочерёдный перезапуск всех воркеров (например, после обновления кода): следующий
+    # останавливается, когда предыдущий уже заменён, - остальные тем временем работают
+    def restart_all(self):
+        threading.Thread(target=self._restart_all, name="supervisor-restart-all", daemon=True).start()
+
+    def _restart_all(self):
+        for index in range(self.processes):
+            thread = self.restart(index)
+            if thread is None:
+                return
+            thread.join()
+
+    def _handle(self, message: tuple):
+        if message[0] == 'ready':
+            with self._lock:
+                self.stats['started'] += 1
+        elif message[0] == 'drain':
+            self.restart(message[1])
+        elif message[0] == 'stats':
+            with self._lock:
+                for key, value in message[2].items():
+                    self.stats[key] += value
+
+    def _watch(self):
+        while not self._stopping:
+            try:
+                self._handle(self.control.get(timeout=1))
+            except queue.Empty:
+                pass
+            with self._lock:
+                # Воркеры, которые сейчас перезапускаются, завершаются сами
+                dead = [(index, worker) for index, worker in enumerate(self._workers)
+                        if index not in self._buffers and not worker.is_alive()]
+            for index, worker in dead:
+                if not self._stopping:
+                    log_error('supervisor', RuntimeError(f"воркер {index} завершился с кодом {worker.exitcode}"))
+                    self.restart(index)
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+        self._monitor.join()
+        # Начатые перезапуски доводим до конца: буфер их чатов должен достаться новому процессу
+        for thread in list(self._replacers.values()):
+            thread.join()
+        for updates in self._queues:
+            updates.put(None)
+        for updates, worker in zip(self._queues, self._workers):
+            worker.join(BOT_DRAIN_TIMEOUT)
+            if worker.is_alive():
+                # Не дождались - недоставленные обновления теряются, процесс не должен зависнуть на их отправке
+                worker.terminate()
+                worker.join()
+                updates.cancel_join_thread()
+        # Итоговые счётчики, которые воркеры прислали при завершении
+        while True:
+            try:
+                self._handle(self.control.get(timeout=0.1))
+            except queue.Empty:
+                break
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['draining'] = len(self._buffers)
+        stats['processes'] = self.processes
+        stats['alive'] = sum(worker.is_alive() for worker in self._workers)
+        return stats
+
+
+# Webhook супервизора: обновление не обрабатывается на месте, а передаётся воркеру его чата
+class ShardedWebhookServer(WebhookServer):
+    def __init__(self, address: Tuple[str, int], supervisor: Supervisor):
+        super().__init__(address, workers=0)
+        self.supervisor = supervisor
+
+    def enqueue(self, body: bytes) -> bool:
+        try:
+            update = json.loads(body)
+        except ValueError as e:
+            log_error('webhook', e, "Некорректное обновление из webhook")
+            return True
+        self.supervisor.route(update, body.decode("utf-8"))
+        with self._lock:
+            self.stats['received'] += 1
+        return True
+
+
+# Long polling супервизора: обновления не разбираются в объекты, а сразу уходят воркерам
+def poll_updates(supervisor: Supervisor):
+    offset = None
+    while True:
+        try:
+            updates = telebot.apihelper.get_updates(bot.token, offset=offset, timeout=BOT_POLL_TIMEOUT + 5,
+                                                    long_polling_timeout=BOT_POLL_TIMEOUT)
+        except Exception as e:
+            log_error('get_updates', e)
+            time.sleep(3)
+            continue
+        for update in updates:
+            offset = update['update_id'] + 1
+            supervisor.route(update)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+# Запуск бота несколькими процессами: SIGHUP супервизору - поочерёдный перезапуск воркеров,
+# SIGTERM воркеру - перезапуск только его, SIGTERM или Ctrl+C супервизору - остановка с доработкой очередей
+def run_supervisor():
+    supervisor = Supervisor().start()
+    METRICS_SOURCES['supervisor'] = supervisor.snapshot
+    signal.signal(signal.SIGTERM, _interrupt)
+    signal.signal(signal.SIGHUP, lambda signum, frame: supervisor.restart_all())
+    print(f"👥 Воркеров: {supervisor.processes}, чаты распределяются по crc32(chat_id)")
+    server = None
+    try:
+        if BOT_UPDATES == 'webhook':
+            server = ShardedWebhookServer((WEBHOOK_LISTEN, WEBHOOK_PORT), supervisor)
+            METRICS_SOURCES['webhook'] = server.snapshot
+            if WEBHOOK_URL:
+                bot.remove_webhook()
+                bot.set_webhook(url=WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+            server.start()
+            print(f"🌐 Webhook слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+            threading.Event().wait()
+        else:
+            poll_updates(supervisor)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.stop()
+        supervisor.stop()
+        print(f"👥 Воркеры остановлены: {supervisor.snapshot()}")
+
+
+# Счётчики компонентов для /metrics
+METRICS_SOURCES: Dict[str, Callable[[], Dict]] = {
+    'db_pool': db_pool_stats,
+    'sessions': sessions.snapshot,
+    'user_cache': user_cache.snapshot,
+    'user_stats_cache': user_stats_cache.snapshot,
+    'base_words': base_words_cache.snapshot_stats,
+    'card_queue': card_queue.snapshot,
+    'answer_dictionary': answer_dictionary.snapshot,
+    'answer_log': answer_log.snapshot,
+    'outbound': outbound.snapshot,
+    'chat_serializer': chat_serializer.snapshot,
+}
+
+
+# Эндпоинт метрик в формате Prometheus: GET /metrics
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = metrics.render(METRICS_SOURCES).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
-    except Exception as e:
-        print(f"Ошибка в обработке callback: {e}\nТрассировка: {traceback.format_exc()}")
-        bot.answer_callback_query(call.id, "⚠️ Произошла ошибка. Попробуйте снова.")
+
+# Запуск эндпоинта метрик в фоновом потоке
+def start_metrics_server(port: int = METRICS_PORT) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((METRICS_LISTEN, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"📈 Метрики: http://{METRICS_LISTEN}:{port}/metrics")
+    return server
 
 
 # Проверка подключения к БД и запуск бота
@@ -555,26 +3951,39 @@ if __name__ == '__main__':
     print("🚀 Бот запускается...")
 
     try:
-        # Проверка подключения к БД
-        with db_connection() as conn:
-            with conn.cursor() as cur:
-                # Проверка существования необходимых таблиц
-                for table in ['users', 'base_words', 'user_words']:
-                    cur.execute(f"""
-                        SELECT EXISTS (
-                            SELECT FROM information_schema.tables 
-                            WHERE table_name = '{table}'
-                        )
-                    """)
-                    if not cur.fetchone()[0]:
-                        raise Exception(f"Таблица '{table}' не существует")
+        # Проверка подключения к БД и версии схемы, недостающие миграции применяются
+        for name in migrate_schema():
+            print(f"🗄 Применена миграция {name}")
 
         print("✅ Подключение к БД выполнено успешно!")
 
-        # Запуск бота
-        print("🙏 Бот готов к работе!")
-        bot.infinity_polling()
+        # Загрузка общего словаря в память
+        base_words_cache.refresh(force=True)
+        print(f"📖 Загружено базовых слов: {base_words_cache.snapshot_stats()['size']}")
 
+        if METRICS_PORT:
+            start_metrics_server()
+
+        # Запуск бота
+        print(f"🙏 Бот готов к работе! Режим: {BOT_MODE}, обновления: {BOT_UPDATES}")
+        # SIGTERM (обычная остановка под systemd и docker) - как Ctrl+C, чтобы отработал finally
+        signal.signal(signal.SIGTERM, _interrupt)
+        if BOT_PROCESSES > 1:
+            run_supervisor()
+        elif BOT_UPDATES == 'webhook':
+            run_webhook()
+        elif BOT_MODE == 'async':
+            asyncio.run(run_async_polling())
+        else:
+            bot.infinity_polling()
+
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         print(f"Ошибка при запуске бота: {e}\nТрассировка: {traceback.format_exc()}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        card_queue.shutdown()
+        outbound.shutdown()
+        answer_log.shutdown()
+        close_db_pool()
\ No newline at end of file
@@ -0,0 +1,40 @@
+-- Исходная схема. IF NOT EXISTS - чтобы базы, созданные раньше вручную, приняли миграции без ошибок
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    telegram_id BIGINT UNIQUE NOT NULL,
+    username VARCHAR(100),
+    first_name VARCHAR(100),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS base_words (
+    id SERIAL PRIMARY KEY,
+    word VARCHAR(100) NOT NULL,
+    translation VARCHAR(100) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS user_words (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    word VARCHAR(100) NOT NULL,
+    translation VARCHAR(100) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(user_id, word)
+);
+
+-- Начальный словарь - только в пустую таблицу
+INSERT INTO base_words (word, translation)
+SELECT word, translation FROM (VALUES
+    ('привет', 'hello'),
+    ('мир', 'world'),
+    ('книга', 'book'),
+    ('солнце', 'sun'),
+    ('вода', 'water'),
+    ('дом', 'house'),
+    ('мама', 'mother'),
+    ('папа', 'father'),
+    ('друг', 'friend'),
+    ('любовь', 'love')
+) AS seed(word, translation)
+WHERE NOT EXISTS (SELECT 1 FROM base_words);
@@ -0,0 +1,16 @@
+-- Версия словаря для кэша бота: updated_at меняется при каждом изменении строки
+ALTER TABLE base_words ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS base_words_updated_at_idx ON base_words (updated_at);
+
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS base_words_touch_updated_at ON base_words;
+CREATE TRIGGER base_words_touch_updated_at
+    BEFORE UPDATE ON base_words
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
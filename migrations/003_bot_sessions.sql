@@ -0,0 +1,8 @@
+-- Сессии чатов (при SESSION_BACKEND=postgres)
+CREATE TABLE IF NOT EXISTS bot_sessions (
+    chat_id BIGINT PRIMARY KEY,
+    data JSONB NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS bot_sessions_updated_at_idx ON bot_sessions (updated_at);
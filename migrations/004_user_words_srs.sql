@@ -0,0 +1,9 @@
+-- Интервальное повторение (SM-2): новое слово сразу ждёт повторения
+ALTER TABLE user_words
+    ADD COLUMN IF NOT EXISTS ease REAL NOT NULL DEFAULT 2.5,
+    ADD COLUMN IF NOT EXISTS interval_days REAL NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS repetitions INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS due_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ADD COLUMN IF NOT EXISTS reviewed_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS user_words_due_idx ON user_words (user_id, due_at);
@@ -0,0 +1,13 @@
+-- Журнал ответов на карточки (пишется пачками из фонового потока бота)
+CREATE TABLE IF NOT EXISTS answer_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    word_id INTEGER,  -- id из user_words, NULL для слов из base_words
+    word VARCHAR(100) NOT NULL,
+    correct BOOLEAN NOT NULL,
+    retry BOOLEAN NOT NULL,  -- повторная попытка после ошибки
+    latency_ms INTEGER,  -- время от отправки карточки до ответа
+    answered_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS answer_events_user_idx ON answer_events (user_id, answered_at);
@@ -0,0 +1,10 @@
+-- Счётчики пользователя: обновляются в тех же транзакциях, что и user_words и answer_events.
+-- Счётчик слов для существующих пользователей бот посчитает при первом обращении
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    words_count INTEGER NOT NULL DEFAULT 0,
+    answers INTEGER NOT NULL DEFAULT 0,
+    correct_answers INTEGER NOT NULL DEFAULT 0,  -- верные ответы с первой попытки
+    streak INTEGER NOT NULL DEFAULT 0,  -- текущая серия верных ответов
+    best_streak INTEGER NOT NULL DEFAULT 0
+);
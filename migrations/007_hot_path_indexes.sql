@@ -0,0 +1,3 @@
+-- Индексы под частые запросы бота.
+-- Слова пользователя по порядку добавления (выгрузка /export): без индекса - сортировка всех слов пользователя
+CREATE INDEX IF NOT EXISTS user_words_user_id_id_idx ON user_words (user_id, id);
@@ -0,0 +1,10 @@
+-- updated_at - время самого изменения, а не начала транзакции: иначе долгая транзакция,
+-- закоммиченная позже, ставит строке время раньше уже прочитанного ботом MAX(updated_at)
+ALTER TABLE base_words ALTER COLUMN updated_at SET DEFAULT clock_timestamp();
+
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = clock_timestamp();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;